@@ -0,0 +1,21 @@
+# Gunicorn configuration for production
+# Launch with: gunicorn main:app -c gunicorn_conf.py
+import os
+import multiprocessing
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# Each worker is a separate process with its own event loop and its own
+# lifespan (Mongo/Redis clients, Postgres pool), so keep
+# workers * POOL_SIZE under the database's max_connections
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * multiprocessing.cpu_count() + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+worker_connections = 1000
+keepalive = 30
+
+timeout = 60
+graceful_timeout = 30
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
@@ -1,26 +1,49 @@
 from fastapi import FastAPI, WebSocket
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from src.api.home.router import router as api_router
 from src.api.auth.router import router as auth_router
-from src.chat_works.ws import websocket_listener, websocket_chat_endpoint
-from src.configure.database import init_mongo
-from src.configure.redis import init_redis
+from src.api.auth.service import load_token_blacklist
+from src.chat_works.ws import websocket_listener, websocket_chat_endpoint, init_chat_collections
+from src.configure.database import init_mongo, close_mongo, warm_up_pool
+from src.configure.redis import init_redis, get_redis_client, close_redis
 from src.configure.celery import celery_app
-from src.configure.logging_config import logger
+from src.configure.logging_config import logger, setup_logging
+from src.common.helper import load_google_client_config
 import uvicorn
 
+try:
+    # uvloop runs the event loop in C; fall back to stock asyncio where it
+    # cannot be installed (e.g. Windows dev machines)
+    import uvloop  # noqa: F401
+    EVENT_LOOP = "uvloop"
+except ImportError:
+    EVENT_LOOP = "asyncio"
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Per worker process, after gunicorn has forked
+    setup_logging()
     logger.info("Starting application...")
     await init_mongo()
+    await init_chat_collections()
+    await warm_up_pool()
     await init_redis()
+    load_google_client_config()
+    # Shared Redis client for request handlers; see request.app.state.redis.
+    # Outbound HTTP goes through the module-level AsyncGroq client in
+    # src.chains.simple_chain, which owns the process-wide httpx pool.
+    app.state.redis = await get_redis_client()
+    await load_token_blacklist(app.state.redis)
     celery_app.conf.broker_connection_retry_on_startup = True
     logger.info("Application started successfully")
     yield
     logger.info("Shutting down application...")
+    await close_redis()
+    await close_mongo()
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "https://aicoderdemo.devtrust.biz"],
@@ -40,4 +63,4 @@ async def chat_ws(websocket: WebSocket):
     await websocket_chat_endpoint(websocket)
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, loop=EVENT_LOOP, http="httptools")
\ No newline at end of file
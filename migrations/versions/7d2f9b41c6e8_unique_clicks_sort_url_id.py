@@ -0,0 +1,46 @@
+"""unique clicks sort_url_id
+
+Revision ID: 7d2f9b41c6e8
+Revises: e41b7c9d2a05
+Create Date: 2026-10-15 22:14:36.908121
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2f9b41c6e8'
+down_revision: Union[str, Sequence[str], None] = 'e41b7c9d2a05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Fold duplicate rows into the oldest one per URL before enforcing uniqueness
+    op.execute("""
+        WITH merged AS (
+            SELECT sort_url_id, MIN(id) AS keep_id, SUM(click_count) AS total, MAX(last_clicked_at) AS last_clicked_at
+            FROM clicks
+            GROUP BY sort_url_id
+            HAVING COUNT(*) > 1
+        )
+        UPDATE clicks
+        SET click_count = merged.total, last_clicked_at = merged.last_clicked_at
+        FROM merged
+        WHERE clicks.id = merged.keep_id
+    """)
+    op.execute("""
+        DELETE FROM clicks
+        USING clicks AS kept
+        WHERE clicks.sort_url_id = kept.sort_url_id AND clicks.id > kept.id
+    """)
+    op.create_unique_constraint('clicks_sort_url_id_key', 'clicks', ['sort_url_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('clicks_sort_url_id_key', 'clicks', type_='unique')
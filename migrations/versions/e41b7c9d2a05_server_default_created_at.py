@@ -0,0 +1,32 @@
+"""server default created_at
+
+Revision ID: e41b7c9d2a05
+Revises: 9c4e2a7d1f38
+Create Date: 2026-10-15 21:02:11.384215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41b7c9d2a05'
+down_revision: Union[str, Sequence[str], None] = '9c4e2a7d1f38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('users', 'ulrs', 'clicks')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        op.alter_column(table, 'created_at', server_default=sa.text("timezone('utc', now())"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.alter_column(table, 'created_at', server_default=None)
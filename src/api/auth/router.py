@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from sqlalchemy.orm import Session
+from fastapi.security import HTTPAuthorizationCredentials
 from .schema import Login, Registraion
-from .service import create_user, login_user, get_current_user
+from .service import create_user, login_user, logout_user, get_current_user, oauth2_scheme
 from src.configure.database import get_db
 router = APIRouter(
     prefix="/auth",
@@ -25,5 +26,10 @@ async def me(current_user: dict = Depends(get_current_user)):
     return {"result": current_user}
 
 @router.post("/logout")
-async def logout(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
-    return {"message": "Logout successful"}
\ No newline at end of file
+async def logout(
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    token: HTTPAuthorizationCredentials = Depends(oauth2_scheme),
+):
+    response = await logout_user(request=request, token=token)
+    return {"message": response["message"]}
\ No newline at end of file
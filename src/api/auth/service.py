@@ -1,53 +1,129 @@
-from sqlalchemy.sql import select
+from sqlalchemy.sql import select, bindparam
+from sqlalchemy.exc import IntegrityError
+from redis.exceptions import ResponseError
 from src.models.user_model import User
-from datetime import datetime, timedelta
+import time
 from src.configure.database import get_db
-from fastapi import HTTPException, Depends
+from fastapi import HTTPException, Depends, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from src.configure.settings import get_settings
-from src.configure.redis import get_redis_client
+from src.configure.settings import settings
 from src.common.helper import generate_token, decode_token, generate_unique_id
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 # OAuth2 scheme for token validation
 oauth2_scheme = HTTPBearer()
 
+# Hot-path user lookups, built once so every call reuses the cached compiled SQL
+USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+USER_BY_ID = select(User).where(User.user_id == bindparam("uid"))
+
+USER_ID_ATTEMPTS = 3
+USER_ID_CONSTRAINT = "users_user_id_key"
+
+
+def _violated_constraint(exc: IntegrityError) -> str | None:
+    """Name of the constraint behind an asyncpg IntegrityError, if Postgres reported one."""
+    # SQLAlchemy's asyncpg adapter keeps the driver exception as the cause
+    return getattr(exc.orig.__cause__, "constraint_name", None)
+
+
+# Revoked tokens live in blacklist:token:<token> (with TTL) and in RedisBloom
+# filters bucketed by token lifetime, so the common "not revoked" case is
+# answered without touching the exact keys. A token revoked during bucket N
+# expires before bucket N+1 ends, so checks look at the current and previous
+# bucket and every filter expires after two lifetimes instead of growing forever.
+BLACKLIST_BLOOM_PREFIX = "blacklist:bf"
+_bloom_enabled = True  # switched off when the RedisBloom module is unavailable
+
+def _bloom_bucket(offset: int = 0) -> tuple[str, int]:
+    """Filter key for the current token-lifetime window (shifted by offset) and when it may expire."""
+    window = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    bucket = int(time.time()) // window + offset
+    return f"{BLACKLIST_BLOOM_PREFIX}:{bucket}", (bucket + 2) * window
+
+async def _bloom_add(redis_client, tokens: list[str]):
+    key, expire_at = _bloom_bucket()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.execute_command("BF.MADD", key, *tokens)
+        pipe.expireat(key, expire_at)
+        await pipe.execute()
+
+async def is_token_blacklisted(redis_client, token: str) -> bool:
+    global _bloom_enabled
+    if _bloom_enabled:
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.execute_command("BF.EXISTS", _bloom_bucket()[0], token)
+                pipe.execute_command("BF.EXISTS", _bloom_bucket(-1)[0], token)
+                if not any(await pipe.execute()):
+                    return False
+        except ResponseError:
+            _bloom_enabled = False
+    # Bloom hit (possibly a false positive) or no bloom: confirm with the exact key
+    return bool(await redis_client.exists(f"blacklist:token:{token}"))
+
+async def load_token_blacklist(redis_client):
+    """Seed the current bloom bucket from the blacklist keys that are still alive."""
+    global _bloom_enabled
+    tokens = [
+        key.removeprefix("blacklist:token:")
+        async for key in redis_client.scan_iter(match="blacklist:token:*", count=1000)
+    ]
+    try:
+        await redis_client.execute_command("BF.EXISTS", _bloom_bucket()[0], "")
+        # Every live key expires within one lifetime, inside the current bucket's span
+        for i in range(0, len(tokens), 1000):
+            await _bloom_add(redis_client, tokens[i:i + 1000])
+    except ResponseError:
+        _bloom_enabled = False
+
 async def get_current_user(
+    request: Request,
     token: HTTPAuthorizationCredentials = Depends(oauth2_scheme),
 ):
     try:
-        payload = await decode_token(token.credentials)
-        return payload
+        payload = decode_token(token.credentials)
     except Exception as e:
         raise HTTPException(
             status_code=403, detail=f"Invalid authentication credentials: {str(e)}"
         )
+    if await is_token_blacklisted(request.app.state.redis, token.credentials):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return payload
 
 async def create_user(payload=None, db: AsyncSession = Depends(get_db)):
     user_data = payload.dict()
     del user_data["confirm_password"]
-    user_data["user_id"] = await generate_unique_id("user", 10)
-    user = User(**user_data)
-    db.add(user)
-    await db.commit()
-    await db.refresh(user)
+    # Insert first and let the unique index on user_id catch the rare collision,
+    # instead of checking for a free id before every insert
+    for _ in range(USER_ID_ATTEMPTS):
+        user_data["user_id"] = await generate_unique_id("user", 10)
+        db.add(User(**user_data))
+        try:
+            await db.commit()
+            break
+        except IntegrityError as e:
+            await db.rollback()
+            # Only a user_id collision is worth another id; any other constraint fails the same way again
+            if _violated_constraint(e) != USER_ID_CONSTRAINT:
+                raise
+    else:
+        raise HTTPException(status_code=500, detail="Could not allocate a user id")
     return {"message": "User created successfully"}
 
 async def login_user(payload=None, db: AsyncSession = Depends(get_db)):
-    settings = get_settings()
-    query = select(User).where(User.email == payload.email)
-    result = await db.execute(query)
+    result = await db.execute(USER_BY_EMAIL, {"email": payload.email})
     user_data = result.scalars().first()
     
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
     
-    expiry_time = int(settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    expiry_time = settings.ACCESS_TOKEN_EXPIRE_MINUTES
     payload_data = {
         "email": user_data.email,
         "role": user_data.role,
         "is_active": user_data.is_active,
-        "exp": datetime.utcnow() + timedelta(minutes=expiry_time)
+        "exp": int(time.time()) + expiry_time * 60
     }
     generated_token = await generate_token(payload_data)
     del payload_data["exp"]
@@ -59,16 +135,16 @@ async def login_user(payload=None, db: AsyncSession = Depends(get_db)):
     }
 
 async def logout_user(
-    payload: dict = None,
-    db: AsyncSession = Depends(get_db),
+    request: Request,
     token: HTTPAuthorizationCredentials = Depends(oauth2_scheme)
 ):
-    settings = get_settings()
-    redis_client = await get_redis_client()
-    expiry_time = int(settings.ACCESS_TOKEN_EXPIRE_MINUTES) * 60  # Convert to seconds
+    redis_client = request.app.state.redis
+    expiry_time = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60  # Convert to seconds
     await redis_client.setex(
         f"blacklist:token:{token.credentials}",
         expiry_time,
         "invalidated"
     )
+    if _bloom_enabled:
+        await _bloom_add(redis_client, [token.credentials])
     return {"message": "User logged out successfully"}
\ No newline at end of file
@@ -1,25 +1,26 @@
-import os
+import json
 import asyncio
 import logging
 from src.models.url_model import SortUrls
 from src.models.click_model import Clicks
 from src.models.user_model import User, Email
 from src.configure.database import get_db as get_async_db
-from datetime import datetime
+from src.configure.settings import settings
+from datetime import datetime, timezone
 from src.api.home.service import (
     create_sort_ulr,
     get_menual_long_url,
     update_menual_long_url,
 )
 from pydantic import BaseModel
-from src.configure.celery import celery_app
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import select
 from src.chains.simple_chain import open_ai_question
 from fastapi import APIRouter, HTTPException, Request, Depends
-from src.api.auth.service import get_current_user
+from src.api.auth.service import get_current_user, USER_BY_ID
+from src.common.helper import load_google_client_config
 from src.api.home.tasks import parse_gmail_emails_async, parse_outlook_emails_async
-from google_auth_oauthlib.flow import InstalledAppFlow
+from google_auth_oauthlib.flow import Flow
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -27,20 +28,28 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["Home"])
 
+GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+GMAIL_OAUTH_STATE_TTL = 600  # seconds the user has to finish the consent screen
+CLICK_TS_TTL = 86400  # last-click timestamps outlive many flush runs, never forever
+
 class Question(BaseModel):
     question: str
 
 class UserIdsList(BaseModel):
     user_ids: list[str]  # Fixed from user_emails
 
+def current_user_org(email: str):
+    """Scalar subquery for the caller's organization, inlined into the users query."""
+    return select(User.organization__org_name).where(User.email == email).scalar_subquery()
+
 @router.get("/{slug}")
-async def get_long_url(slug: str, db: AsyncSession = Depends(get_async_db)):
+async def get_long_url(slug: str, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Retrieves the original long URL using the short slug.
     Returns a 404 if the slug doesn’t exist.
     """
     logger.info(f"Fetching long URL for slug: {slug}")
     try:
-        response = await get_menual_long_url(slug, db)
+        response = await get_menual_long_url(slug, db, request.app.state.redis)
         if not response:
             logger.warning(f"Slug {slug} not found")
             raise HTTPException(status_code=404, detail="Slug not found")
@@ -50,13 +59,13 @@ async def get_long_url(slug: str, db: AsyncSession = Depends(get_async_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/shorten")
-async def shorten_url(long_url: str, db: AsyncSession = Depends(get_async_db)):
+async def shorten_url(long_url: str, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Shortens a long URL and returns the shortened version.
     If the long URL already exists, return the existing short link.
     """
     logger.info(f"Shortening URL: {long_url}")
     try:
-        response = await create_sort_ulr(long_url, db)
+        response = await create_sort_ulr(long_url, db, request.app.state.redis)
         logger.info(f"Shortened URL created: {response}")
         return response
     except Exception as e:
@@ -65,14 +74,14 @@ async def shorten_url(long_url: str, db: AsyncSession = Depends(get_async_db)):
 
 @router.put("/{slug}")
 async def update_long_url(
-    slug: str, new_long_url: str, db: AsyncSession = Depends(get_async_db)
+    slug: str, new_long_url: str, request: Request, db: AsyncSession = Depends(get_async_db)
 ):
     """Updates the long URL associated with an existing slug.
     Validates the new URL and applies expiration logic.
     """
     logger.info(f"Updating slug {slug} to new long URL: {new_long_url}")
     try:
-        response = await update_menual_long_url(slug, new_long_url, db)
+        response = await update_menual_long_url(slug, new_long_url, db, request.app.state.redis)
         if not response:
             logger.warning(f"Slug {slug} not found for update")
             raise HTTPException(status_code=404, detail="Slug not found")
@@ -90,28 +99,27 @@ async def redirect_short_url(
     full_short_url = f"http://localhost:8000/short.ly/{short_code}"
     logger.info(f"Redirecting short URL: {full_short_url}")
 
-    short_url = await db.query(SortUrls).filter_by(short_url=full_short_url).first()
+    result = await db.execute(
+        select(SortUrls.id, Clicks.click_count)
+        .outerjoin(Clicks, Clicks.sort_url_id == SortUrls.id)
+        .where(SortUrls.short_url == full_short_url)
+    )
+    short_url = result.first()
     if not short_url:
         logger.warning(f"Short URL {full_short_url} not found")
         raise HTTPException(status_code=404, detail="Short URL not found")
 
-    click = await db.query(Clicks).filter_by(sort_url_id=short_url.id).first()
-    if click:
-        click.click_count += 1
-        click.last_clicked_at = datetime.now()
-        await db.commit()
-        await db.refresh(click)
-        logger.info(f"Updated click count for sort_url_id {short_url.id}: {click.click_count}")
-    else:
-        logger.info(f"No click found for sort_url_id {short_url.id}, creating new click")
-        click = Clicks(
-            sort_url_id=short_url.id, click_count=1, last_clicked_at=datetime.now()
-        )
-        db.add(click)
-        await db.commit()
-        await db.refresh(click)
+    # Buffer the click in Redis; flush_click_counts_async folds it into Postgres
+    now = datetime.now(timezone.utc)
+    redis_client = request.app.state.redis
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.incr(f"clicks:{short_url.id}")
+        pipe.set(f"clicks:ts:{short_url.id}", now.isoformat(), ex=CLICK_TS_TTL)
+        pending_clicks, _ = await pipe.execute()
+    logger.info(f"Buffered click for sort_url_id {short_url.id}: {pending_clicks} pending")
 
-    return {"click_count": click.click_count, "last_clicked_at": click.last_clicked_at}
+    # Lifetime total: what has been flushed to Postgres plus what is still buffered
+    return {"click_count": (short_url.click_count or 0) + pending_clicks, "last_clicked_at": now}
 
 @router.post("/ask")
 async def ask_open_ai(question: Question):
@@ -134,27 +142,19 @@ async def trigger_gmail(
     """Triggers Gmail email parsing for specified user_ids."""
     logger.info(f"User {current_user.get('email')} initiating Gmail parsing for user_ids: {user_ids_list.user_ids}")
     
-    # Fetch users based on role
+    # Filter by requested ids and token presence in SQL instead of scanning the org in Python
+    stmt = select(User.user_id, User.email, User.token_json).where(
+        User.user_id.in_(user_ids_list.user_ids),
+        User.token_json.is_not(None),
+        User.is_active.is_(True),
+    )
     if current_user.get("role") != "admin":
-        current_user_record = await db.execute(
-            select(User).where(User.email == current_user["email"])
-        ).scalar_one_or_none()
-        if not current_user_record:
-            logger.error(f"Current user {current_user['email']} not found")
-            raise HTTPException(status_code=404, detail="Current user not found")
-        org_name = current_user_record.organization__org_name
-        users = await db.query(User).filter_by(
-            is_active=True, organization__org_name=org_name
-        ).all()
-    else:
-        users = await db.execute(select(User).where(User.is_active == True))
-        users = users.scalars().all()
-
-    # Filter valid users with tokens
+        stmt = stmt.where(User.organization__org_name == current_user_org(current_user["email"]))
+
+    result = await db.execute(stmt)
     valid_users = [
-        {"user_id": user.user_id, "email": user.email, "token_json": user.token_json}
-        for user in users
-        if user.user_id in user_ids_list.user_ids and user.token_json
+        {"user_id": row.user_id, "email": row.email, "token_json": row.token_json}
+        for row in result.all()
     ]
 
     if not valid_users:
@@ -176,31 +176,27 @@ async def get_users(
     """Fetches list of active users, restricted by role/organization."""
     logger.info(f"User {current_user.get('email')} fetching users")
     
+    # Project only the returned columns; no ORM instances are built for the list
+    stmt = select(User.user_id, User.email, User.role).where(User.is_active.is_(True))
     if current_user.get("role") != "admin":
-        current_user_record = await db.execute(select(User).where(User.email == current_user["email"])).scalar_one_or_none()
-        if not current_user_record:
-            logger.error(f"Current user {current_user['email']} not found")
-            raise HTTPException(status_code=404, detail="Current user not found")
-        users = await db.execute(select(User).filter_by(
-            is_active=True, organization__org_name=current_user_record.organization__org_name
-        ))
-        users = users.scalars().all()  # Extract list from Result
-    else:
-        users = await db.execute(select(User).filter_by(is_active=True))
-        users = users.scalars().all()
-
-    return [{"user_id": user.user_id, "email": user.email, "role": user.role} for user in users]
+        stmt = stmt.where(User.organization__org_name == current_user_org(current_user["email"]))
+
+    result = await db.execute(stmt)
+    return [{"user_id": row.user_id, "email": row.email, "role": row.role} for row in result.all()]
 
 @router.post("/auth/gmail/{user_id}")
 async def auth_gmail(
     user_id: str,
+    request: Request,
     db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Authenticates Gmail for a user and stores token_json."""
+    """Starts the Gmail OAuth web flow for a user.
+    Returns the Google consent URL; Google redirects back to /auth/gmail/callback.
+    """
     logger.info(f"User {current_user.get('email')} initiating Gmail auth for user_id: {user_id}")
     
-    user = await db.execute(select(User).filter_by(user_id=user_id))
+    user = await db.execute(USER_BY_ID, {"uid": user_id})
     user = user.scalar_one_or_none()
     if not user:
         logger.error(f"User with user_id {user_id} not found")
@@ -209,26 +205,67 @@ async def auth_gmail(
         logger.warning(f"User {current_user.get('email')} not authorized to authenticate user_id {user_id}")
         raise HTTPException(status_code=403, detail="Not authorized to authenticate this user")
 
-    from src.configure.settings import settings
+    client_config = load_google_client_config()
+    if not client_config:
+        logger.error("Google credentials not found")
+        raise HTTPException(status_code=500, detail="Google credentials not configured")
 
-    user_email = user.email  # Preload to avoid lazy loading
-    SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
-    creds_path = settings.GOOGLE_CLIENT_SECRET_PATH
-    if not creds_path or not os.path.exists(creds_path):
-        logger.error(f"Google credentials not found at {creds_path}")
+    try:
+        flow = Flow.from_client_config(client_config, GMAIL_SCOPES, redirect_uri=settings.GOOGLE_REDIRECT_URI)
+        authorization_url, state = flow.authorization_url(
+            access_type="offline", prompt="consent", include_granted_scopes="true"
+        )
+        redis_client = request.app.state.redis
+        await redis_client.set(
+            f"gmail_oauth_state:{state}",
+            json.dumps({"user_id": user_id, "code_verifier": flow.code_verifier}),
+            ex=GMAIL_OAUTH_STATE_TTL,
+        )
+        return {"authorization_url": authorization_url}
+    except Exception as e:
+        logger.error(f"Failed to start Gmail auth for user_id {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Gmail authentication failed: {str(e)}")
+
+@router.get("/auth/gmail/callback")
+async def auth_gmail_callback(
+    code: str, state: str, request: Request, db: AsyncSession = Depends(get_async_db)
+):
+    """Completes the Gmail OAuth web flow and stores token_json."""
+    redis_client = request.app.state.redis
+    pending = await redis_client.getdel(f"gmail_oauth_state:{state}")
+    if not pending:
+        logger.warning("Gmail OAuth callback with unknown or expired state")
+        raise HTTPException(status_code=400, detail="Invalid or expired OAuth state")
+    pending = json.loads(pending)
+    user_id = pending["user_id"]
+
+    client_config = load_google_client_config()
+    if not client_config:
+        logger.error("Google credentials not found")
         raise HTTPException(status_code=500, detail="Google credentials not configured")
 
     try:
-        flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES)
-        creds = await asyncio.get_event_loop().run_in_executor(None, lambda: flow.run_local_server(port=8080))
-        user.token_json = creds.to_json()
-        await db.commit()
-        logger.info(f"Gmail authenticated for user_id {user_id} (email: {user_email})")
-        return {"status": f"Authenticated Gmail for {user_email}"}
+        flow = Flow.from_client_config(
+            client_config, GMAIL_SCOPES, state=state, redirect_uri=settings.GOOGLE_REDIRECT_URI
+        )
+        flow.code_verifier = pending["code_verifier"]
+        await asyncio.get_running_loop().run_in_executor(None, lambda: flow.fetch_token(code=code))
     except Exception as e:
-        logger.error(f"Failed to authenticate Gmail for user_id {user_id}: {str(e)}")
+        logger.error(f"Failed to exchange Gmail auth code for user_id {user_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Gmail authentication failed: {str(e)}")
 
+    user = await db.execute(USER_BY_ID, {"uid": user_id})
+    user = user.scalar_one_or_none()
+    if not user:
+        logger.error(f"User with user_id {user_id} not found")
+        raise HTTPException(status_code=404, detail="User not found")
+
+    user_email = user.email  # Preload to avoid lazy loading
+    user.token_json = flow.credentials.to_json()
+    await db.commit()
+    logger.info(f"Gmail authenticated for user_id {user_id} (email: {user_email})")
+    return {"status": f"Authenticated Gmail for {user_email}"}
+
 @router.post("/emails/outlook")
 async def trigger_outlook(
     user_ids_list: UserIdsList,
@@ -238,37 +275,26 @@ async def trigger_outlook(
     """Triggers Outlook email parsing for specified user_ids."""
     logger.info(f"User {current_user.get('email')} initiating Outlook parsing for user_ids: {user_ids_list.user_ids}")
     
+    stmt = select(User.user_id, User.email, User.outlook_token_json).where(
+        User.user_id.in_(user_ids_list.user_ids),
+        User.outlook_token_json.is_not(None),
+        User.is_active.is_(True),
+    )
     if current_user.get("role") != "admin":
-        current_user_record = await db.query(User).filter_by(email=current_user["email"]).first()
-        if not current_user_record:
-            logger.error(f"Current user {current_user['email']} not found")
-            raise HTTPException(status_code=404, detail="Current user not found")
-        org_name = current_user_record.organization__org_name
-        users = await db.query(User).filter_by(
-            is_active=True, organization__org_name=org_name
-        ).all()
-    else:
-        users = await db.query(User).filter_by(is_active=True).all()
+        stmt = stmt.where(User.organization__org_name == current_user_org(current_user["email"]))
 
+    result = await db.execute(stmt)
     valid_users = [
-        {"user_id": user.user_id, "email": user.email, "outlook_token_json": user.outlook_token_json}
-        for user in users
-        if user.user_id in user_ids_list.user_ids and user.outlook_token_json
+        {"user_id": row.user_id, "email": row.email, "outlook_token_json": row.outlook_token_json}
+        for row in result.all()
     ]
 
     if not valid_users:
         logger.warning("No valid users with Outlook OAuth tokens found")
         raise HTTPException(status_code=400, detail="No users with valid Outlook OAuth tokens found")
 
-    for user in valid_users:
-        logger.info(f"Triggering Outlook parsing for user_id: {user['user_id']}")
-        celery_app.send_task(
-            'parse_outlook_emails_async',
-            kwargs={
-                'user_id': user['user_id'],
-                'email': user['email'],
-                'token_json': user['outlook_token_json']
-            }
-        )
+    # One broker publish for the whole batch, same as the Gmail trigger
+    logger.info(f"Triggering Outlook parsing for {len(valid_users)} users")
+    parse_outlook_emails_async.delay(valid_users)
 
     return {"status": f"Outlook email parsing started for {len(valid_users)} users."}
\ No newline at end of file
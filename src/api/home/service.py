@@ -4,61 +4,88 @@ from src.common.helper import generate_self_short_ulr
 from src.models.url_model import SortUrls
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import select
-from src.configure.redis import redis_client, REDIS_CHANNEL
+from sqlalchemy.dialects.postgresql import insert
+from redis.asyncio import Redis
+from src.configure.redis import REDIS_CHANNEL
 
-async def create_sort_ulr(url: str, db: AsyncSession) -> str:
+# Slug -> long URL lookups are read-heavy, cache them for a day
+SLUG_CACHE_TTL = 86400
+
+async def create_sort_ulr(url: str, db: AsyncSession, redis_client: Redis) -> str:
     """
     Create a short URL from a long URL.
     If a custom slug is provided, it will be used; otherwise, a random slug will be generated.
     """
-    existing_url = await db.execute(select(SortUrls).filter(SortUrls.long_url == url)).scalar_one_or_none()
-    message = ""
-    if existing_url:
-        message = f"Sort url already created"
-        await redis_client.publish(REDIS_CHANNEL, message)
-        output = {
-            "short_url": existing_url.short_url,
-        }
-        return output
-    short_url = generate_self_short_ulr(url)
-    new_sort_url = SortUrls(long_url=url, short_url=short_url)
-    db.add(new_sort_url)
-    db.commit()
-    db.refresh(new_sort_url)
-    message = f"new sort url creted"
-    await redis_client.publish(REDIS_CHANNEL, message)
+    # The transaction commits on exit and rolls back if anything inside raises
+    async with db.begin():
+        result = await db.execute(select(SortUrls.short_url).where(SortUrls.long_url == url))
+        short_url = result.scalar_one_or_none()
+        existing_url = short_url is not None
+        if not existing_url:
+            stmt = (
+                insert(SortUrls)
+                .values(long_url=url, short_url=generate_self_short_ulr(url))
+                .on_conflict_do_nothing(index_elements=[SortUrls.long_url])
+                .returning(SortUrls.id, SortUrls.short_url)
+            )
+            inserted = (await db.execute(stmt)).one_or_none()
+            if inserted is None:
+                # A concurrent request created the same long URL first
+                result = await db.execute(select(SortUrls.short_url).where(SortUrls.long_url == url))
+                short_url = result.scalar_one()
+                existing_url = True
+            else:
+                sort_url_id, short_url = inserted
+
+    # The commit has landed, so publish and prime the slug cache in one round-trip
+    async with redis_client.pipeline(transaction=False) as pipe:
+        if existing_url:
+            pipe.publish(REDIS_CHANNEL, "Sort url already created")
+        else:
+            pipe.set(f"slug:{sort_url_id}", url, ex=SLUG_CACHE_TTL)
+            pipe.publish(REDIS_CHANNEL, "new sort url creted")
+        await pipe.execute()
+
     output = {
-        "short_url": new_sort_url.short_url,
+        "short_url": short_url,
     }
     return output
 
 
-async def get_menual_long_url(slug: int, db: AsyncSession) -> str:
+async def get_menual_long_url(slug: int, db: AsyncSession, redis_client: Redis) -> str:
     """
     Retrieve the original long URL using the short slug.
     Returns a 404 if the slug doesn’t exist.
     """
-    sort_url = db.query(SortUrls).filter(SortUrls.id == slug).first()
+    cached_long_url = await redis_client.get(f"slug:{slug}")
+    if cached_long_url:
+        return {"long_url": cached_long_url}
+
+    result = await db.execute(select(SortUrls).where(SortUrls.id == slug))
+    sort_url = result.scalar_one_or_none()
     if not sort_url:
         raise ValueError("Slug not found")
+    await redis_client.set(f"slug:{slug}", sort_url.long_url, ex=SLUG_CACHE_TTL)
     output = {
         "long_url": sort_url.long_url
     }
     return output
 
 
-async def update_menual_long_url(slug: int, new_long_url: str, db: AsyncSession) -> str:
+async def update_menual_long_url(slug: int, new_long_url: str, db: AsyncSession, redis_client: Redis) -> str:
     """
     Updates the long URL associated with an existing slug.
     Validates the new URL and applies expiration logic.
     """
-    sort_url = db.query(SortUrls).filter(SortUrls.id == slug).first()
+    result = await db.execute(select(SortUrls).where(SortUrls.id == slug))
+    sort_url = result.scalar_one_or_none()
     if not sort_url:
         raise ValueError("Slug not found")
 
     sort_url.long_url = new_long_url
-    db.commit()
-    db.refresh(sort_url)
+    await db.commit()
+    await db.refresh(sort_url)
+    await redis_client.delete(f"slug:{slug}")
     
     output = {
         "short_url": sort_url.short_url,
@@ -66,17 +93,19 @@ async def update_menual_long_url(slug: int, new_long_url: str, db: AsyncSession)
     }
     return output
 
-async def delete_sort_url(slug: int, db: AsyncSession) -> str:
+async def delete_sort_url(slug: int, db: AsyncSession, redis_client: Redis) -> str:
     """
     Deletes a short URL entry based on the slug.
     Returns a confirmation message if successful.
     """
-    sort_url = await db.execute(select(SortUrls).filter(SortUrls.id == slug)).scalar_one_or_none()
+    result = await db.execute(select(SortUrls).where(SortUrls.id == slug))
+    sort_url = result.scalar_one_or_none()
     if not sort_url:
         raise ValueError("Slug not found")
     
-    db.delete(sort_url)
-    db.commit()
+    await db.delete(sort_url)
+    await db.commit()
+    await redis_client.delete(f"slug:{slug}")
     
     return {"message": "Short URL deleted successfully"}
 
@@ -1,21 +1,246 @@
-import os
 import base64
+import binascii
 import asyncio
 import aiohttp
 import time
 import json
+import random
+import uuid
+from functools import lru_cache
+from urllib.parse import urlencode
 from src.models.url_model import SortUrls
+from src.models.click_model import Clicks
 from src.models.user_model import Email, User
 from src.configure.database import AsyncSessionLocal
 from src.configure.settings import settings
-from sqlalchemy import select
-from datetime import datetime, timedelta
-from src.configure.celery import celery_app
-from google_auth_oauthlib.flow import InstalledAppFlow
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert
+from datetime import datetime, timedelta, timezone
+from src.configure.celery import celery_app, run_async
+from src.configure.redis import get_redis_client
+from celery.signals import worker_process_shutdown
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from msal import ConfidentialClientApplication
+from msal import ConfidentialClientApplication, SerializableTokenCache
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1/users/me"
+GMAIL_BATCH_URL = "https://gmail.googleapis.com/batch/gmail/v1"
+GMAIL_CONCURRENCY = 10  # max users parsed in parallel per task
+GMAIL_MESSAGE_FIELDS = "payload(headers,body/data,parts(mimeType,body/data,parts(mimeType,body/data)))"
+GMAIL_B64_CHUNK = 1 << 20  # decode large bodies 1 MiB of text at a time (multiple of 4)
+_URLSAFE_TO_STD = str.maketrans("-_", "+/")
+GMAIL_REFRESH_MARGIN = timedelta(minutes=5)
+GRAPH_API_URL = "https://graph.microsoft.com/v1.0"
+GRAPH_SCOPE = ["https://graph.microsoft.com/.default"]
+# Only the fields we store, with bodies as plain text instead of HTML
+OUTLOOK_SELECT = "id,subject,from,body"
+OUTLOOK_PREFER = 'outlook.body-content-type="text", odata.maxpagesize=50'
+OUTLOOK_INITIAL_SYNC = timedelta(days=1)  # window for a user's first delta sync
+OUTLOOK_DELTA_TTL = 30 * 86400
+
+
+class NeedsReauthError(Exception):
+    """Raised when a user's Gmail token can't be refreshed without the consent screen."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        super().__init__(f"Gmail authorization required for user {user_id}")
+
+# Shared HTTP session for the Gmail and Microsoft Graph APIs so keep-alive
+# sockets, TLS sessions and DNS answers survive across calls instead of being
+# rebuilt per task
+_http_session: aiohttp.ClientSession | None = None
+_http_session_loop: asyncio.AbstractEventLoop | None = None
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    global _http_session, _http_session_loop
+    loop = asyncio.get_running_loop()
+    # A session is bound to the loop that created it
+    if _http_session is None or _http_session.closed or _http_session_loop is not loop:
+        # No global cap; each API host gets its own keep-alive pool
+        connector = aiohttp.TCPConnector(
+            limit=0, limit_per_host=50, enable_cleanup_closed=True, ttl_dns_cache=300, keepalive_timeout=60
+        )
+        timeout = aiohttp.ClientTimeout(total=30, connect=5, sock_read=10)
+        _http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        _http_session_loop = loop
+    return _http_session
+
+
+def _is_transient(exc: BaseException) -> bool:
+    # Retry throttling, server errors and network failures; other 4xx won't change on retry
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+HTTP_ATTEMPTS = 3
+
+# Shared by every outbound Google/Graph call
+retry_transient = retry(
+    retry=retry_if_exception(_is_transient),
+    stop=stop_after_attempt(HTTP_ATTEMPTS),
+    wait=wait_exponential_jitter(initial=1, max=10),
+    reraise=True,
+)
+
+
+@retry_transient
+async def http_get_json(url: str, headers: dict, params: dict | None = None) -> dict:
+    session = await get_http_session()
+    async with session.get(url, headers=headers, params=params) as resp:
+        resp.raise_for_status()
+        return await resp.json()
+
+
+@worker_process_shutdown.connect
+def close_http_session(**kwargs):
+    if _http_session is not None and not _http_session.closed and _http_session_loop.is_running():
+        asyncio.run_coroutine_threadsafe(_http_session.close(), _http_session_loop).result(timeout=5)
+
+
+def _b64url_decode_into(buf: bytearray, data: str):
+    if len(data) <= GMAIL_B64_CHUNK:
+        buf += base64.urlsafe_b64decode(data)
+        return
+    for i in range(0, len(data), GMAIL_B64_CHUNK):
+        buf += binascii.a2b_base64(data[i:i + GMAIL_B64_CHUNK].translate(_URLSAFE_TO_STD))
+
+
+def decode_gmail_body(payload: dict) -> str:
+    """Decode a Gmail message body, joining every text/plain part in order."""
+    body = bytearray()
+    data = payload.get('body', {}).get('data')
+    if data:
+        _b64url_decode_into(body, data)
+    else:
+        parts = list(reversed(payload.get('parts', [])))
+        while parts:
+            part = parts.pop()
+            if part.get('parts'):
+                parts.extend(reversed(part['parts']))
+            elif part.get('mimeType') == 'text/plain' and part.get('body', {}).get('data'):
+                _b64url_decode_into(body, part['body']['data'])
+    return body.decode('utf-8', errors='replace')
+
+
+class GmailAsyncClient:
+    """Thin Gmail REST client on the shared aiohttp session.
+
+    Talks to the REST and batch endpoints directly instead of going through
+    googleapiclient, so there is no discovery document to parse and no
+    blocking httplib2 transport.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, token: str):
+        self.session = session
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    async def list_messages(self, max_results: int = 5) -> list[dict]:
+        result = await http_get_json(f"{GMAIL_API_URL}/messages", self.headers, {"maxResults": max_results})
+        return result.get('messages', [])
+
+    async def batch_get(self, ids: list[str], fields: str = GMAIL_MESSAGE_FIELDS) -> list[dict]:
+        """Fetch messages in one multipart/mixed round-trip.
+
+        Returns one dict per id, in request order: the message resource, or
+        {"error": ...} when that message's sub-request failed.
+        """
+        if not ids:
+            return []
+        results = {}
+        pending = ids
+        for attempt in range(HTTP_ATTEMPTS):
+            try:
+                results.update(await self._post_batch(pending, fields))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # Keep the messages an earlier round already fetched
+                if attempt == 0:
+                    raise
+                break
+            # Sub-requests can be throttled or fail on their own inside a 200 batch
+            pending = [message_id for message_id in pending if self._should_retry(results.get(message_id))]
+            if not pending or attempt == HTTP_ATTEMPTS - 1:
+                break
+            await asyncio.sleep(min(10, 2 ** attempt) + random.random())
+        return [results.get(message_id, {"error": "missing from batch response"}) for message_id in ids]
+
+    @retry_transient
+    async def _post_batch(self, ids: list[str], fields: str) -> dict[str, dict]:
+        boundary = f"batch_{uuid.uuid4().hex}"
+        query = urlencode({"format": "full", "fields": fields})
+        body = "".join(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <{message_id}>\r\n\r\n"
+            f"GET /gmail/v1/users/me/messages/{message_id}?{query}\r\n\r\n"
+            for message_id in ids
+        ) + f"--{boundary}--\r\n"
+
+        results = {}
+        async with self.session.post(
+            GMAIL_BATCH_URL,
+            data=body.encode(),
+            headers={**self.headers, "Content-Type": f"multipart/mixed; boundary={boundary}"},
+        ) as resp:
+            resp.raise_for_status()
+            reader = aiohttp.MultipartReader.from_response(resp)
+            while (part := await reader.next()) is not None:
+                # Gmail echoes each Content-ID back as <response-{id}>
+                message_id = part.headers.get("Content-ID", "").strip("<>").removeprefix("response-")
+                results[message_id] = self._parse_http_part(await part.read())
+        return results
+
+    @staticmethod
+    def _should_retry(result: dict | None) -> bool:
+        if result is None:
+            return True
+        status = result.get("status", 200)
+        return status == 429 or status >= 500
+
+    @staticmethod
+    def _parse_http_part(raw: bytes) -> dict:
+        # Each part is a raw HTTP response: status line, headers, blank line, JSON body
+        head, _, payload = raw.partition(b"\r\n\r\n")
+        status = int(head.split(b" ", 2)[1])
+        data = json.loads(payload) if payload.strip() else {}
+        if status >= 400:
+            return {"error": data.get("error", {}).get("message", f"HTTP {status}"), "status": status}
+        return data
+
+
+@lru_cache(maxsize=1)
+def get_msal_app() -> ConfidentialClientApplication:
+    """Build the MSAL app once per worker process so its token cache survives across tasks."""
+    return ConfidentialClientApplication(
+        settings.OUTLOOK_CLIENT_ID,
+        authority=f"https://login.microsoftonline.com/{settings.OUTLOOK_TENANT_ID}",
+        client_credential=settings.OUTLOOK_CLIENT_SECRET,
+        token_cache=SerializableTokenCache(),
+    )
+
+
+async def _persist_emails(db, user_id, parsed):
+    """Upsert parsed Gmail/Outlook messages for a user; the caller commits."""
+    rows = [
+        {
+            "message_id": email_data['message_id'],
+            "subject": email_data['subject'],
+            "sender": email_data['sender'],
+            "body": email_data['body'],
+            "user_id": user_id,
+        }
+        for email_data in parsed
+        if "error" not in email_data
+    ]
+    if not rows:
+        return
+    # One multi-row Core INSERT; the unique message_id constraint does the dedup
+    await db.execute(insert(Email).values(rows).on_conflict_do_nothing(index_elements=[Email.message_id]))
 
 
 @celery_app.task(name="parse_gmail_emails_async")
@@ -25,125 +250,85 @@ def parse_gmail_emails_async(users: list[dict]):
     Example: [{"user_id": "user1", "email": "abc@gmail.com", "token_json": "..."}, ...]
     """
 
+    async def _refresh_creds(user_id, creds) -> bool:
+        # Refresh when expired or about to expire, so the token stays valid for the whole batch
+        if creds.valid and not (creds.expiry and creds.expiry - datetime.utcnow() < GMAIL_REFRESH_MARGIN):
+            return False
+        if not creds.refresh_token:
+            # The consent screen can't be shown from a worker; the user has to
+            # re-authorize through /api/auth/gmail
+            raise NeedsReauthError(user_id)
+        await asyncio.get_running_loop().run_in_executor(None, creds.refresh, Request())
+        return True
+
+    async def _persist_creds(db, user_id, creds):
+        await db.execute(update(User).where(User.user_id == user_id).values(token_json=creds.to_json()))
+
+    async def _fetch_messages(creds):
+        client = GmailAsyncClient(await get_http_session(), creds.token)
+        # Fetch latest messages, then all of their bodies in one batch request
+        messages = await client.list_messages(max_results=5)
+        ids = [msg['id'] for msg in messages]
+        parsed = []
+        for message_id, response in zip(ids, await client.batch_get(ids)):
+            if "error" in response:
+                parsed.append({"message_id": message_id, "error": response["error"]})
+                continue
+            payload = response.get('payload', {})
+            message_headers = {h.get('name'): h.get('value') for h in payload.get('headers', [])}
+            parsed.append({
+                "message_id": message_id,
+                "subject": message_headers.get('Subject', ""),
+                "sender": message_headers.get('From', ""),
+                "body": decode_gmail_body(payload),
+            })
+        return parsed
+
     async def _parse_user(user):
         start_time = time.time()
         user_id = user["user_id"]
-        email = user["email"]
-        token_json = user["token_json"]
-
-        SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
-        creds_path = settings.GOOGLE_CLIENT_SECRET_PATH
-
-        if not creds_path or not os.path.exists(creds_path):
-            raise FileNotFoundError(f"Credentials file not found at: {creds_path}")
-
-        loop = asyncio.get_event_loop()
-        creds = Credentials.from_authorized_user_info(json.loads(token_json), SCOPES)
-
-        # Refresh token if expired
-        if not creds.valid:
-            if creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-                async with AsyncSessionLocal() as db:
-                    result = await db.execute(select(User).where(User.user_id == user_id))
-                    user_obj = result.scalars().first()
-                    if user_obj:
-                        user_obj.token_json = json.dumps(creds.to_json())
-                        await db.commit()
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES)
-                creds = await loop.run_in_executor(None, lambda: flow.run_local_server(port=8080))
-                async with AsyncSessionLocal() as db:
-                    result = await db.execute(select(User).where(User.user_id == user_id))
-                    user_obj = result.scalars().first()
-                    if user_obj:
-                        user_obj.token_json = json.dumps(creds.to_json())
-                        await db.commit()
-
-        service = build('gmail', 'v1', credentials=creds, cache_discovery=False)
-
-        async def fetch_message_batch(messages):
-            batch_results = []
-
-            def callback(request_id, response, exception):
-                if exception:
-                    batch_results.append({"message_id": request_id, "error": str(exception)})
-                    return
-
-                payload = response.get('payload', {})
-                headers = payload.get('headers', [])
-                subject = next((h['value'] for h in headers if h.get('name') == 'Subject'), "")
-                sender = next((h['value'] for h in headers if h.get('name') == 'From'), "")
-                body = ""
-
-                if 'data' in payload.get('body', {}):
-                    data = payload['body'].get('data', '')
-                    if data:
-                        body = base64.urlsafe_b64decode(data.encode()).decode()
-                else:
-                    for part in payload.get('parts', []):
-                        data = part.get('body', {}).get('data', '')
-                        if data:
-                            body = base64.urlsafe_b64decode(data.encode()).decode()
-                            break
-
-                batch_results.append({
-                    "message_id": request_id,
-                    "subject": subject,
-                    "sender": sender,
-                    "body": body,
-                })
-
-            batch = service.new_batch_http_request()
-            for msg in messages:
-                batch.add(
-                    service.users().messages().get(userId='me', id=msg['id'], format='full'),
-                    callback=callback
-                )
-
-            await loop.run_in_executor(None, batch.execute)
-            return batch_results
+        creds = Credentials.from_authorized_user_info(json.loads(user["token_json"]), GMAIL_SCOPES)
 
-        # Fetch latest messages
-        results = await loop.run_in_executor(
-            None,
-            lambda: service.users().messages().list(userId='me', maxResults=5).execute()
-        )
-        messages = results.get('messages', [])
-        parsed = await fetch_message_batch(messages) if messages else []
-
-        # Store parsed emails in DB
+        # One session and one commit per user for the refreshed token and the new emails
         async with AsyncSessionLocal() as db:
-            for email_data in parsed:
-                if "error" not in email_data:
-                    existing = await db.execute(
-                        select(Email).where(Email.message_id == email_data['message_id'])
-                    )
-                    if not existing.scalars().first():
-                        db.add(Email(
-                            message_id=email_data['message_id'],
-                            subject=email_data['subject'],
-                            sender=email_data['sender'],
-                            body=email_data['body'],
-                            user_id=user_id
-                        ))
+            if await _refresh_creds(user_id, creds):
+                # Saving the new token and listing messages are independent, so
+                # the DB round-trip hides behind the Gmail calls. A TaskGroup
+                # (not gather) cancels and waits for the credential write if the
+                # fetch fails, so the session is never closed under it.
+                try:
+                    async with asyncio.TaskGroup() as tg:
+                        tg.create_task(_persist_creds(db, user_id, creds))
+                        fetch = tg.create_task(_fetch_messages(creds))
+                except ExceptionGroup as eg:
+                    # Surface the original error, as gather did
+                    raise eg.exceptions[0]
+                parsed = fetch.result()
+            else:
+                parsed = await _fetch_messages(creds)
+            await _persist_emails(db, user_id, parsed)
             await db.commit()
 
         end_time = time.time()
         return {"user_id": user_id, "emails": parsed, "execution_time_ms": round((end_time - start_time) * 1000, 2)}
 
     async def _parse_all_users():
-        results = []
-        for user in users:
-            try:
-                result = await _parse_user(user)
-                results.append(result)
-            except Exception as e:
-                results.append({"user_id": user.get("user_id"), "error": str(e)})
-        return results
+        # Users are independent and network-bound, so run them concurrently
+        # with a cap on simultaneous OAuth/Gmail calls
+        semaphore = asyncio.Semaphore(GMAIL_CONCURRENCY)
+
+        async def _bounded_parse(user):
+            async with semaphore:
+                return await _parse_user(user)
+
+        results = await asyncio.gather(*(_bounded_parse(user) for user in users), return_exceptions=True)
+        return [
+            {"user_id": user.get("user_id"), "error": str(result)} if isinstance(result, Exception) else result
+            for user, result in zip(users, results)
+        ]
 
     try:
-        final_result = asyncio.run(_parse_all_users())
+        final_result = run_async(_parse_all_users())
         print(f"Gmail Emails Parsed for {len(final_result)} users")
         return final_result
     except Exception as e:
@@ -157,26 +342,31 @@ def fetch_emails_from_db_async(user_id: str = None, limit: int = 100):
     async def _fetch_emails():
         start_time = time.time()
         async with AsyncSessionLocal() as db:
-            query = select(Email).order_by(Email.created_at.desc()).limit(limit)
+            # Column rows streamed in chunks: no ORM instances, no full buffered result
+            query = (
+                select(Email.message_id, Email.subject, Email.sender, Email.body, Email.created_at)
+                .order_by(Email.created_at.desc())
+                .limit(limit)
+                .execution_options(yield_per=500)
+            )
             if user_id:
                 query = query.where(Email.user_id == user_id)
-            result = await db.execute(query)
-            emails = result.scalars().all()
+            result = await db.stream(query)
             parsed = [
                 {
-                    "message_id": email.message_id,
-                    "subject": email.subject,
-                    "sender": email.sender,
-                    "body": email.body,
-                    "created_at": email.created_at.isoformat()
+                    "message_id": row.message_id,
+                    "subject": row.subject,
+                    "sender": row.sender,
+                    "body": row.body,
+                    "created_at": row.created_at.isoformat()
                 }
-                for email in emails
+                async for row in result
             ]
         end_time = time.time()
         return {"emails": parsed, "execution_time_ms": round((end_time - start_time) * 1000, 2)}
 
     try:
-        result = asyncio.run(_fetch_emails())
+        result = run_async(_fetch_emails())
         print(f"📧 Emails Fetched for User {user_id} (took {result['execution_time_ms']} ms)")
         return result
     except Exception as e:
@@ -185,43 +375,75 @@ def fetch_emails_from_db_async(user_id: str = None, limit: int = 100):
 
 
 @celery_app.task(name="parse_outlook_emails_async")
-def parse_outlook_emails_async():
+def parse_outlook_emails_async(users: list[dict]):
+    """
+    users: list of dicts with keys 'user_id', 'email', 'outlook_token_json'
+    Example: [{"user_id": "user1", "email": "abc@outlook.com", "outlook_token_json": "..."}, ...]
+    """
     async def _parse_outlook_emails():
         start_time = time.time()
-        CLIENT_ID = settings.OUTLOOK_CLIENT_ID
-        TENANT_ID = settings.OUTLOOK_TENANT_ID
-        CLIENT_SECRET = settings.OUTLOOK_CLIENT_SECRET
-        authority = f"https://login.microsoftonline.com/{TENANT_ID}"
-        scope = ["https://graph.microsoft.com/.default"]
-
-        app = ConfidentialClientApplication(
-            CLIENT_ID, authority=authority, client_credential=CLIENT_SECRET
-        )
-        loop = asyncio.get_event_loop()
-        token = await loop.run_in_executor(None, lambda: app.acquire_token_for_client(scopes=scope))
+        app = get_msal_app()
+        # Cached app token first; only go to AAD when it is missing or near expiry
+        token = app.acquire_token_silent(GRAPH_SCOPE, account=None)
+        if not token:
+            loop = asyncio.get_running_loop()
+            token = await loop.run_in_executor(None, lambda: app.acquire_token_for_client(scopes=GRAPH_SCOPE))
         access_token = token.get("access_token")
         if not access_token:
             raise Exception("Failed to acquire Outlook access token")
 
-        async with aiohttp.ClientSession() as session:
-            headers = {"Authorization": f"Bearer {access_token}"}
-            async with session.get("https://graph.microsoft.com/v1.0/me/messages?$top=5", headers=headers) as response:
-                messages = (await response.json()).get("value", [])
-            parsed = [
-                {
-                    "message_id": message.get("id"),
-                    "subject": message.get("subject", ""),
-                    "sender": message.get("from", {}).get("emailAddress", {}).get("address", ""),
-                    "body": message.get("body", {}).get("content", "")
-                }
-                for message in messages
-            ]
+        results = []
+        headers = {"Authorization": f"Bearer {access_token}", "Prefer": OUTLOOK_PREFER}
+        redis_client = await get_redis_client()
+        for user in users:
+            try:
+                # Incremental sync: resume from the delta link saved on the last poll, so
+                # only new or changed messages come back
+                delta_key = f"outlook:delta:{user['user_id']}"
+                url = await redis_client.get(delta_key)
+                params = None
+                if not url:
+                    # App-only tokens have no /me, so address each mailbox explicitly
+                    url = f"{GRAPH_API_URL}/users/{user['email']}/mailFolders/Inbox/messages/delta"
+                    since = (datetime.now(timezone.utc) - OUTLOOK_INITIAL_SYNC).strftime("%Y-%m-%dT%H:%M:%SZ")
+                    params = {"$select": OUTLOOK_SELECT, "$filter": f"receivedDateTime ge {since}"}
+
+                parsed = []
+                delta_link = None
+                while url:
+                    page = await http_get_json(url, headers, params)
+                    params = None  # next/delta links already carry the query
+                    parsed.extend(
+                        {
+                            "message_id": message.get("id"),
+                            "subject": message.get("subject", ""),
+                            "sender": message.get("from", {}).get("emailAddress", {}).get("address", ""),
+                            "body": message.get("body", {}).get("content", "")
+                        }
+                        for message in page.get("value", [])
+                        if "@removed" not in message
+                    )
+                    url = page.get("@odata.nextLink")
+                    delta_link = page.get("@odata.deltaLink", delta_link)
+                # Store the messages before advancing the cursor, so a failed write
+                # is fetched again on the next poll instead of being skipped
+                async with AsyncSessionLocal() as db:
+                    await _persist_emails(db, user["user_id"], parsed)
+                    await db.commit()
+                if delta_link:
+                    await redis_client.set(delta_key, delta_link, ex=OUTLOOK_DELTA_TTL)
+                results.append({"user_id": user["user_id"], "emails": parsed})
+            except Exception as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status == 410:
+                    # Delta link expired; the next poll starts a fresh sync
+                    await redis_client.delete(delta_key)
+                results.append({"user_id": user.get("user_id"), "error": str(e)})
         end_time = time.time()
-        return {"emails": parsed, "execution_time_ms": round((end_time - start_time) * 1000, 2)}
+        return {"users": results, "execution_time_ms": round((end_time - start_time) * 1000, 2)}
 
     try:
-        result = asyncio.run(_parse_outlook_emails())
-        print(f"📧 Outlook Emails Parsed (took {result['execution_time_ms']} ms):", result['emails'])
+        result = run_async(_parse_outlook_emails())
+        print(f"📧 Outlook Emails Parsed for {len(result['users'])} users (took {result['execution_time_ms']} ms)")
         return result
     except Exception as e:
         print(f"Error in Outlook task: {e}")
@@ -235,25 +457,134 @@ def expire_urls_async(batch_size=1000):
         async with AsyncSessionLocal() as db:
             thirty_days_ago = datetime.now() - timedelta(days=30)
             while True:
+                # Core statements per batch: no ORM loading and no per-row DELETE
                 result = await db.execute(
-                    SortUrls.__table__.select()
+                    select(SortUrls.id)
                     .where(SortUrls.created_at < thirty_days_ago)
                     .limit(batch_size)
+                    .with_for_update(skip_locked=True)
                 )
-                expired_urls = result.scalars().all()
-                if not expired_urls:
+                expired_ids = result.scalars().all()
+                if not expired_ids:
                     break
-                for url in expired_urls:
-                    await db.delete(url)
+                # Click rows reference the URLs, so they go first
+                await db.execute(delete(Clicks).where(Clicks.sort_url_id.in_(expired_ids)))
+                await db.execute(delete(SortUrls).where(SortUrls.id.in_(expired_ids)))
                 await db.commit()
-                print(f"Deleted batch of {len(expired_urls)} URLs")
+                print(f"Deleted batch of {len(expired_ids)} URLs")
         end_time = time.time()
         return {"message": "Expired URLs older than 30 days have been deleted.", "execution_time_ms": round((end_time - start_time) * 1000, 2)}
 
     try:
-        result = asyncio.run(_expire_urls())
+        result = run_async(_expire_urls())
         print(f"Expired URLs task (took {result['execution_time_ms']} ms):", result['message'])
         return result
     except Exception as e:
         print(f"Error in expire_urls task: {e}")
         raise
+
+
+
+CLICK_FLUSH_LOCK = "clicks:flush:lock"
+CLICK_FLUSH_LOCK_TTL = 300  # seconds; a crashed run can't block flushing for longer
+
+# Move a URL's buffered clicks into a claim stamped with this run's token. An
+# unfinished claim (the run died before clearing it) is handed back unchanged,
+# token included, so retrying it can't add the same clicks twice.
+CLAIM_CLICKS_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return redis.call('HMGET', KEYS[2], 'token', 'delta')
+end
+local delta = tonumber(redis.call('GET', KEYS[1]) or '0')
+if delta <= 0 then
+    return false
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[2], 'token', ARGV[1], 'delta', delta)
+return {ARGV[1], tostring(delta)}
+"""
+
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+@celery_app.task(name="flush_click_counts_async")
+def flush_click_counts_async():
+    """Fold the per-URL click counters buffered in Redis into the clicks table."""
+    async def _flush_clicks():
+        start_time = time.time()
+        redis_client = await get_redis_client()
+        run_token = uuid.uuid4().hex
+        # Beat fires every minute and tasks are acked late, so runs can overlap
+        if not await redis_client.set(CLICK_FLUSH_LOCK, run_token, nx=True, ex=CLICK_FLUSH_LOCK_TTL):
+            return {"flushed_urls": 0, "skipped": True, "execution_time_ms": round((time.time() - start_time) * 1000, 2)}
+
+        claim_clicks = redis_client.register_script(CLAIM_CLICKS_LUA)
+        release_lock = redis_client.register_script(RELEASE_LOCK_LUA)
+        flushed = 0
+        try:
+            # Live counters plus claims left behind by a run that died mid-way
+            sort_url_ids = set()
+            async for key in redis_client.scan_iter(match="clicks:[0-9]*", count=500):
+                sort_url_ids.add(int(key.split(":", 1)[1]))
+            async for key in redis_client.scan_iter(match="clicks:claim:*", count=500):
+                sort_url_ids.add(int(key.rsplit(":", 1)[1]))
+
+            async with AsyncSessionLocal() as db:
+                for sort_url_id in sort_url_ids:
+                    ts_key = f"clicks:ts:{sort_url_id}"
+                    claim_key = f"clicks:claim:{sort_url_id}"
+                    claim = await claim_clicks(keys=[f"clicks:{sort_url_id}", claim_key], args=[run_token])
+                    if not claim:
+                        continue
+                    token, delta = claim[0], int(claim[1])
+                    last_clicked = await redis_client.get(ts_key)
+                    # Stored as aware UTC; the column is naive UTC like the rest of the schema
+                    last_clicked_at = (
+                        datetime.fromisoformat(last_clicked) if last_clicked else datetime.now(timezone.utc)
+                    ).replace(tzinfo=None)
+                    stmt = insert(Clicks).values(
+                        sort_url_id=sort_url_id, click_count=delta, last_clicked_at=last_clicked_at, last_flush_token=token
+                    )
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[Clicks.sort_url_id],
+                        set_={
+                            "click_count": Clicks.click_count + stmt.excluded.click_count,
+                            "last_clicked_at": func.greatest(Clicks.last_clicked_at, stmt.excluded.last_clicked_at),
+                            "last_flush_token": stmt.excluded.last_flush_token,
+                        },
+                        # A claim that was committed but not cleared is not applied again
+                        where=Clicks.last_flush_token.is_distinct_from(stmt.excluded.last_flush_token),
+                    )
+                    try:
+                        await db.execute(stmt)
+                        await db.commit()
+                    except IntegrityError as e:
+                        # The URL was deleted (e.g. by expire_urls_async); its clicks have nowhere to go
+                        await db.rollback()
+                        await redis_client.delete(claim_key, ts_key)
+                        print(f"Dropped {delta} clicks for missing sort_url_id {sort_url_id}: {e}")
+                        continue
+                    except Exception as e:
+                        # The claim stays with its token and is retried by the next run
+                        await db.rollback()
+                        print(f"Error flushing clicks for sort_url_id {sort_url_id}, will retry next run: {e}")
+                        continue
+                    await redis_client.delete(claim_key)
+                    flushed += 1
+        finally:
+            await release_lock(keys=[CLICK_FLUSH_LOCK], args=[run_token])
+        end_time = time.time()
+        return {"flushed_urls": flushed, "execution_time_ms": round((end_time - start_time) * 1000, 2)}
+
+    try:
+        result = run_async(_flush_clicks())
+        print(f"Click counts flushed for {result['flushed_urls']} URLs (took {result['execution_time_ms']} ms)")
+        return result
+    except Exception as e:
+        print(f"Error in flush_click_counts task: {e}")
+        raise
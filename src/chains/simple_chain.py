@@ -1,8 +1,8 @@
-# from openai import OpenAI
+# from openai import AsyncOpenAI
 # from src.configure.settings import settings
 
 # # Initialize OpenAI client with Hugging Face API
-# client = OpenAI(
+# client = AsyncOpenAI(
 #     # base_url="https://router.huggingface.co/fireworks-ai/inference/v1",
 #     base_url="https://router.huggingface.co/v1",
 #     api_key=settings.HF_API_KEY,
@@ -11,7 +11,7 @@
 # async def open_ai_question(question: str) -> str:
 #     try:
 #         prompt = f"Q: {question}\nA:"
-#         completion = client.chat.completions.create(
+#         completion = await client.chat.completions.create(
 #             model="deepseek-ai/DeepSeek-R1:fastest",
 #             messages=[
 #                 {"role": "user", "content": prompt}
@@ -24,18 +24,28 @@
 #         raise RuntimeError(f"LLM Error: {e}")
 
 
-from groq import Groq
+import httpx
+from groq import AsyncGroq
 from src.configure.settings import settings
 import logging
+import sys
+import time
 
-# Initialize Groq client
-client = Groq(
+STREAM_ECHO_INTERVAL = 0.25  # seconds between stdout writes when DEBUG_STREAM is on
+
+# Initialize Groq client; async so streaming reads don't block the event loop.
+# This module-level client is the process-wide shared HTTP pool; there is no
+# separate httpx client on app.state.
+client = AsyncGroq(
     api_key=settings.GROQ_API_KEY,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    ),
 )
 
 async def open_ai_question(question: str) -> str:
     try:
-        stream = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model="openai/gpt-oss-120b",
             messages=[
                 {"role": "user", "content": question}
@@ -44,17 +54,32 @@ async def open_ai_question(question: str) -> str:
             max_tokens=8192,
             top_p=1,
             reasoning_effort="medium",
-            stream=True, 
+            stream=True,
             stop=None,
         )
 
-        full_response = ""
-        for chunk in stream:
-            content = chunk.choices[0].delta.content or ""
-            full_response += content
-            print(content, end="", flush=True)  # Live output to console/logs
+        # Collect chunks and join once instead of rebuilding the string per chunk
+        parts: list[str] = []
+        echoed = 0
+        next_echo = time.monotonic() + STREAM_ECHO_INTERVAL
+        async for chunk in stream:
+            content = chunk.choices[0].delta.content
+            if content:
+                parts.append(content)
+                # Live output to console/logs, written in batches rather than one syscall per token
+                if settings.DEBUG_STREAM and time.monotonic() >= next_echo:
+                    sys.stdout.write("".join(parts[echoed:]))
+                    sys.stdout.flush()
+                    echoed = len(parts)
+                    next_echo = time.monotonic() + STREAM_ECHO_INTERVAL
+
+        if settings.DEBUG_STREAM and echoed < len(parts):
+            sys.stdout.write("".join(parts[echoed:]) + "\n")
+            sys.stdout.flush()
 
-        return full_response.strip()
+        response = "".join(parts).strip()
+        logging.info(f"Groq completion streamed: {len(parts)} chunks, {len(response)} chars")
+        return response
 
     except Exception as e:
         logging.error(f"Groq LLM call failed: {repr(e)}")
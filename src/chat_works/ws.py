@@ -1,18 +1,23 @@
-import json
-import base64
+import orjson
 import logging
 import asyncio
+import uuid
+import zlib
+from collections import deque
 from typing import Dict
 from bson import ObjectId
+from pymongo import ReturnDocument
+from gridfs import AsyncGridFSBucket
+from gridfs.errors import NoFile
 from datetime import datetime
-from pydantic import BaseModel
+from typing import Annotated
+from pydantic import BaseModel, Field, ValidationError
 from sqlalchemy import or_, func
 from sqlalchemy.sql import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from urllib.parse import quote, parse_qs
-from async_lru import alru_cache
+from urllib.parse import quote, unquote, parse_qs
 from src.models.user_model import User
 from src.common.helper import decode_token
 from src.configure.database import get_mongo_db, get_db
@@ -24,6 +29,17 @@ logger = logging.getLogger(__name__)
 # OAuth2 scheme for token validation
 oauth2_scheme = HTTPBearer()
 
+
+def _dumps(obj) -> str:
+    # orjson encodes datetimes natively; anything else unknown (e.g. ObjectId) falls back to str()
+    return orjson.dumps(obj, default=str).decode()
+
+
+async def send_json(websocket: WebSocket, payload: dict):
+    """Send a JSON frame, encoded with orjson instead of Starlette's json.dumps."""
+    await websocket.send_text(_dumps(payload))
+
+
 # Pydantic model for user response
 class UserResponse(BaseModel):
     id: str
@@ -34,45 +50,136 @@ class UserResponse(BaseModel):
     unread_count: int
     room_id: str | None
 
+# Request payloads, validated once in handle_message before dispatch
+NonEmptyStr = Annotated[str, Field(min_length=1)]
+
+class MessageSendRequest(BaseModel):
+    room_id: str | None
+    sender: str
+    receiver: str
+    message: str
+    filename: str | None = None
+    content_type: str = "application/octet-stream"
+
+class MessageIdRequest(BaseModel):
+    message_id: NonEmptyStr
+
+class MessageEditRequest(BaseModel):
+    message_id: str
+    new_message: str
+
+class MessageTypeRequest(BaseModel):
+    room_id: str | None
+    receiver: str
+    is_typing: bool = True
+
+class UserStatusRequest(BaseModel):
+    email: NonEmptyStr
+
+class UserListRequest(BaseModel):
+    is_pagination: bool = True
+    page: int = 1
+    per_page: int = 10
+    search: str = ""
+
+class MessageListRequest(BaseModel):
+    room_id: NonEmptyStr
+    page: int = 0
+    page_size: int = 20
+
+class ReadListRequest(BaseModel):
+    sender: NonEmptyStr
+
+class EmptyRequest(BaseModel):
+    pass
+
+# Identifies this process on the pub/sub channels: frames are published as
+# "<node id>|<quoted email>|<json>" so a node can route them to the right
+# user and skip the copies it already delivered locally
+NODE_ID = uuid.uuid4().hex
+PUBSUB_SHARDS = 16
+
+def pubsub_shard(email: str) -> int:
+    # crc32 rather than hash(): every node must map an email to the same shard
+    return zlib.crc32(email.encode()) % PUBSUB_SHARDS
+
 # WebSocket manager using Redis pub/sub
 class WebSocketManager:
     def __init__(self):
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
+        # A user typically has 1-3 sockets open, so a plain list per email
+        self.active_connections: Dict[str, list[WebSocket]] = {}
+        # A fixed set of shard listeners, however many users are connected
+        self.listeners: list[asyncio.Task] = []
+        self.subscribed: list[asyncio.Event] = []
 
     async def connect(self, websocket: WebSocket, email: str):
         await websocket.accept()
-        if email not in self.active_connections:
-            self.active_connections[email] = {}
-        connection_id = str(id(websocket))
-        self.active_connections[email][connection_id] = websocket
-
-        redis_client = await get_redis_client()
-        pubsub = redis_client.pubsub()
-        await pubsub.subscribe(f"{REDIS_CHANNEL}:{email}")
-        asyncio.create_task(self.listen_to_pubsub(pubsub, email, connection_id))
+        self.active_connections.setdefault(email, []).append(websocket)
+
+        shard = pubsub_shard(email)
+        if not self.listeners:
+            self.subscribed = [asyncio.Event() for _ in range(PUBSUB_SHARDS)]
+            self.listeners = [
+                asyncio.create_task(self.listen_to_pubsub(n, self.subscribed[n])) for n in range(PUBSUB_SHARDS)
+            ]
+        elif self.listeners[shard].done():
+            # Restart a shard whose listener died (e.g. Redis connection lost)
+            self.subscribed[shard] = asyncio.Event()
+            self.listeners[shard] = asyncio.create_task(self.listen_to_pubsub(shard, self.subscribed[shard]))
+        # Don't return before the user's shard is subscribed, or events
+        # published right after connect would be missed
+        await self.subscribed[shard].wait()
 
     async def disconnect(self, websocket: WebSocket, email: str):
-        connection_id = str(id(websocket))
-        if email in self.active_connections and connection_id in self.active_connections[email]:
-            del self.active_connections[email][connection_id]
-            if not self.active_connections[email]:
+        connections = self.active_connections.get(email)
+        if connections and websocket in connections:
+            connections.remove(websocket)
+            if not connections:
                 del self.active_connections[email]
 
-    async def listen_to_pubsub(self, pubsub, email: str, connection_id: str):
+    async def listen_to_pubsub(self, shard: int, subscribed: asyncio.Event):
+        channel = f"{REDIS_CHANNEL}:shard:{shard}"
+        redis_client = await get_redis_client()
+        pubsub = redis_client.pubsub()
         try:
+            try:
+                await pubsub.subscribe(channel)
+            finally:
+                # Release waiting connects even if subscribing failed
+                subscribed.set()
             async for message in pubsub.listen():
                 if message["type"] == "message":
-                    if email in self.active_connections and connection_id in self.active_connections[email]:
-                        websocket = self.active_connections[email][connection_id]
-                        await websocket.send_text(message["data"])
+                    origin, _, rest = message["data"].partition("|")
+                    if origin == NODE_ID:
+                        continue
+                    group, _, payload = rest.partition("|")
+                    email = unquote(group)
+                    # Copy: a socket may disconnect while we are sending
+                    for websocket in list(self.active_connections.get(email, ())):
+                        try:
+                            await websocket.send_text(payload)
+                        except Exception as e:
+                            logger.warning(f"Dropping pubsub message for a closed socket of {email}: {str(e)}")
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
-            logger.error(f"Pubsub error for {email}: {str(e)}")
+            logger.error(f"Pubsub error on {channel}: {str(e)}")
         finally:
-            await pubsub.unsubscribe(f"{REDIS_CHANNEL}:{email}")
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
 
     async def send_to_group(self, group: str, message: dict):
+        payload = _dumps(message)
+        # Deliver to sockets on this node directly; Redis only carries it to other nodes
+        for websocket in list(self.active_connections.get(group, ())):
+            try:
+                await websocket.send_text(payload)
+            except Exception as e:
+                logger.warning(f"Local delivery to {group} failed: {str(e)}")
         redis_client = await get_redis_client()
-        await redis_client.publish(f"{REDIS_CHANNEL}:{group}", json.dumps(message))
+        await redis_client.publish(
+            f"{REDIS_CHANNEL}:shard:{pubsub_shard(group)}", f"{NODE_ID}|{quote(group)}|{payload}"
+        )
 
 manager = WebSocketManager()
 
@@ -81,16 +188,16 @@ def get_safe_cache_key(prefix: str, email: str) -> str:
     return f"{prefix}_{safe_email}"
 
 async def get_current_user_websocket(token: str):
-    logger.debug(f"Received token: {token[:10] if token else None}...")
+    logger.debug("Received token: %s...", token[:10] if token else None)
     if not token:
         logger.error("No token provided")
         raise HTTPException(status_code=403, detail="No token provided")
     try:
         token = token.strip().strip('"\'')
-        logger.debug(f"Processed token: {token[:10]}...")
+        logger.debug("Processed token: %s...", token[:10])
         credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
-        payload = await decode_token(credentials.credentials)
-        logger.debug(f"Token validated, payload: {payload}")
+        payload = decode_token(credentials.credentials)
+        logger.debug("Token validated, payload: %s", payload)
         return payload
     except Exception as e:
         logger.error(f"Token validation failed: {str(e)}", exc_info=True)
@@ -100,15 +207,19 @@ async def get_current_user_websocket(token: str):
 
 async def websocket_chat_endpoint(websocket: WebSocket, token: str = None):
     query_string = websocket.scope.get('query_string', b'').decode()
-    logger.debug(f"WebSocket connection attempt with scope: {websocket.scope}")
-    logger.debug(f"Query string: {query_string}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("WebSocket connection attempt with scope: %s", websocket.scope)
+        logger.debug("Query string: %s", query_string)
+
+    query_params = parse_qs(query_string)
+    # Clients that can unpack a message.batch frame opt in with ?batch=1
+    supports_batch = query_params.get('batch', ['0'])[0] in ('1', 'true')
 
     if not token:
         logger.debug("Token parameter is None, attempting manual query string parsing")
-        query_params = parse_qs(query_string)
         token_values = query_params.get('token', [])
         token = token_values[0] if token_values else None
-        logger.debug(f"Manually parsed token: {token[:10] if token else None}...")
+        logger.debug("Manually parsed token: %s...", token[:10] if token else None)
 
     if not token:
         logger.warning("No token provided in query parameter or parsed query string")
@@ -133,45 +244,47 @@ async def websocket_chat_endpoint(websocket: WebSocket, token: str = None):
     await manager.connect(websocket, email)
 
     redis_client = await get_redis_client()
-    await redis_client.set(get_safe_cache_key("user_status", email), "online")
-    await redis_client.set(get_safe_cache_key("user_last_seen", email), datetime.utcnow().isoformat())
+    connected_at = datetime.utcnow().isoformat()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(get_safe_cache_key("user_status", email), "online")
+        pipe.set(get_safe_cache_key("user_last_seen", email), connected_at)
+        await pipe.execute()
 
-    await websocket.send_json({
+    await send_json(websocket, {
         "source": "connection",
         "data": {
             "message": "connected",
             "email": email,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": connected_at,
         },
     })
 
-    await send_pending_messages(websocket, email)
+    await send_pending_messages(websocket, email, supports_batch)
     await receive_unread_message(websocket, email)
 
     try:
         while True:
-            data = await websocket.receive_json()
-            logger.debug(f"Received message from {email}: {data}")
+            data = orjson.loads(await websocket.receive_text())
+            logger.debug("Received message from %s: %s", email, data)
             await handle_message(websocket, email, data)
     except WebSocketDisconnect:
         await manager.disconnect(websocket, email)
-        await redis_client.set(get_safe_cache_key("user_status", email), "offline")
-        await redis_client.set(
-            get_safe_cache_key("user_last_seen", email),
-            datetime.utcnow().isoformat(),
-            ex=30 * 24 * 60 * 60,
-        )
-        await redis_client.publish(
-            REDIS_CHANNEL,
-            json.dumps({
-                "source": "user.status",
-                "data": {
-                    "email": email,
-                    "status": "offline",
-                    "last_seen": datetime.utcnow().isoformat(),
-                }
-            })
-        )
+        last_seen = datetime.utcnow().isoformat()
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(get_safe_cache_key("user_status", email), "offline")
+            pipe.set(get_safe_cache_key("user_last_seen", email), last_seen, ex=30 * 24 * 60 * 60)
+            pipe.publish(
+                REDIS_CHANNEL,
+                _dumps({
+                    "source": "user.status",
+                    "data": {
+                        "email": email,
+                        "status": "offline",
+                        "last_seen": last_seen,
+                    }
+                })
+            )
+            await pipe.execute()
         logger.info(f"User {email} disconnected")
     except Exception as e:
         logger.error(f"WebSocket error for {email}: {str(e)}", exc_info=True)
@@ -184,13 +297,27 @@ async def handle_message(websocket: WebSocket, email: str, data: dict):
         if not source:
             raise ValueError("Missing message source")
 
-        handler_name = f"receive_{source.replace('.', '_')}"
-        handler = globals().get(handler_name)
-        if not handler:
+        body = data.get("data") or {}
+        if source == "message.list" and not body.get("room_id"):
+            logger.debug("No room_id provided for %s, returning user list", email)
+            source = "user.list"
+
+        entry = HANDLERS.get(source)
+        if not entry:
             raise ValueError(f"Unknown message source: {source}")
+        handler, schema = entry
 
-        logger.debug(f"Handling message source {source} for {email}")
-        await handler(websocket, email, data)
+        # user.list takes its parameters at the top level of the frame
+        payload = schema.model_validate(data if source == "user.list" else body)
+        logger.debug("Handling message source %s for %s", source, email)
+        await handler(websocket, email, payload)
+    except WebSocketDisconnect:
+        # Let the connection loop clean up presence instead of replying on a closed socket
+        raise
+    except ValidationError as e:
+        fields = ", ".join(".".join(str(loc) for loc in err["loc"]) for err in e.errors())
+        logger.warning(f"Invalid payload from {email}: {fields}")
+        await send_error(websocket, "validation_error", f"Missing or invalid fields: {fields}")
     except ValueError as e:
         logger.warning(f"Invalid message from {email}: {str(e)}")
         await send_error(websocket, "invalid_request", str(e))
@@ -199,70 +326,107 @@ async def handle_message(websocket: WebSocket, email: str, data: dict):
         await send_error(websocket, "server_error", "Internal server error")
 
 async def send_error(websocket: WebSocket, error_type: str, message: str):
-    await websocket.send_json({
+    await send_json(websocket, {
         "source": "error",
         "error": {"type": error_type, "message": message}
     })
 
-@alru_cache(maxsize=1)
-async def get_messages_collection():
-    db = await get_mongo_db()
-    return db["messages"]
+# Collection handles, resolved once at startup by init_chat_collections()
+messages_collection = None
+rooms_collection = None
+files_bucket = None
 
-@alru_cache(maxsize=1)
-async def get_rooms_collection():
-    db = await get_mongo_db()
-    return db["rooms"]
+# Attachment bytes live in GridFS; never load legacy inline data with a message
+MESSAGE_PROJECTION = {"file.data": 0}
+ATTACHMENT_FRAME_TIMEOUT = 30  # seconds to wait for the binary frame after message.send
+MAX_ATTACHMENT_SIZE = 10 * 1024 * 1024
 
-async def receive_message_send(websocket: WebSocket, email: str, data: dict):
-    message_data = data.get("data", {})
-    required_fields = ["room_id", "sender", "receiver", "message"]
-    if not all(field in message_data for field in required_fields):
-        await send_error(websocket, "validation_error", "Missing required fields")
-        return
+async def init_chat_collections():
+    global messages_collection, rooms_collection, files_bucket
+    db = await get_mongo_db()
+    messages_collection = db["messages"]
+    rooms_collection = db["rooms"]
+    files_bucket = AsyncGridFSBucket(db, bucket_name="chat_files")
+    # Covers the unread-count aggregations ($match on receiver/is_read, group by sender)
+    await messages_collection.create_index([("receiver", 1), ("is_read", 1), ("sender", 1)])
+    await rooms_collection.create_index("participants")
+
+def file_metadata(file_doc: dict) -> dict:
+    return {
+        "file_id": str(file_doc["file_id"]) if file_doc.get("file_id") else None,
+        "filename": file_doc["filename"],
+        "size": file_doc["size"],
+        "content_type": file_doc["content_type"],
+    }
 
-    if message_data["sender"] != email:
+async def receive_message_send(websocket: WebSocket, email: str, message_data: MessageSendRequest):
+    if message_data.sender != email:
         await send_error(websocket, "permission_denied", "Cannot send messages as another user")
         return
 
-    rooms_collection = await get_rooms_collection()
-    room_id = message_data["room_id"]
+    # One clock read so a new room's last_message_at matches its first message
+    now = datetime.utcnow()
+    room_id = message_data.room_id
     if not room_id:
         existing_room = await rooms_collection.find_one({
-            "participants": {"$all": [message_data["sender"], message_data["receiver"]]}
+            "participants": {"$all": [message_data.sender, message_data.receiver]}
         })
         if existing_room:
             room_id = str(existing_room["_id"])
         else:
             room_doc = {
-                "participants": [message_data["sender"], message_data["receiver"]],
-                "created_at": datetime.utcnow(),
-                "last_message_at": datetime.utcnow()
+                "participants": [message_data.sender, message_data.receiver],
+                "created_at": now,
+                "last_message_at": now
             }
             result = await rooms_collection.insert_one(room_doc)
             room_id = str(result.inserted_id)
-            logger.debug(f"Created new room with ID: {room_id} for {message_data['sender']} and {message_data['receiver']}")
-        message_data["room_id"] = room_id
+            logger.debug("Created new room with ID: %s for %s and %s", room_id, message_data.sender, message_data.receiver)
+        message_data.room_id = room_id
 
-    messages_collection = await get_messages_collection()
     message_doc = {
         "room_id": room_id,
-        "sender": message_data["sender"],
-        "receiver": message_data["receiver"],
-        "message": message_data["message"],
-        "timestamp": datetime.utcnow(),
+        "sender": message_data.sender,
+        "receiver": message_data.receiver,
+        "message": message_data.message,
+        "timestamp": now,
         "is_read": False,
-        "delivered": False,
+        # Fanned out right below, so it is stored as delivered up front
+        # instead of a follow-up update_one
+        "delivered": True,
     }
 
-    if message_data.get("file") and message_data.get("filename"):
+    # Attachments follow the message.send frame as one binary frame and go
+    # straight to GridFS; the message only keeps a reference
+    if message_data.filename:
+        try:
+            frame = await asyncio.wait_for(websocket.receive(), ATTACHMENT_FRAME_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"No file data from {email} for {message_data.filename}")
+            await send_error(websocket, "file_error", "Timed out waiting for file data")
+            return
+        if frame["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(frame.get("code", 1000))
+        file_data = frame.get("bytes")
+        if file_data is None:
+            await send_error(websocket, "file_error", "Expected a binary frame with the file data")
+            # The client moved on without sending the file; still handle what it sent
+            if frame.get("text"):
+                await handle_message(websocket, email, orjson.loads(frame["text"]))
+            return
+        if len(file_data) > MAX_ATTACHMENT_SIZE:
+            await send_error(websocket, "file_error", f"File exceeds {MAX_ATTACHMENT_SIZE // (1024 * 1024)} MB limit")
+            return
         try:
-            file_data = base64.b64decode(message_data["file"])
+            content_type = message_data.content_type
+            file_id = await files_bucket.upload_from_stream(
+                message_data.filename, file_data, metadata={"content_type": content_type, "sender": email}
+            )
             message_doc["file"] = {
-                "filename": message_data["filename"],
+                "file_id": file_id,
+                "filename": message_data.filename,
                 "size": len(file_data),
-                "data": file_data,
-                "content_type": message_data.get("content_type", "application/octet-stream"),
+                "content_type": content_type,
             }
         except Exception as e:
             logger.error(f"File processing error: {str(e)}")
@@ -277,44 +441,34 @@ async def receive_message_send(websocket: WebSocket, email: str, data: dict):
         "data": {
             "message_id": message_id,
             "room_id": room_id,
-            "sender": message_data["sender"],
-            "receiver": message_data["receiver"],
-            "message": message_data["message"],
+            "sender": message_data.sender,
+            "receiver": message_data.receiver,
+            "message": message_data.message,
             "timestamp": message_doc["timestamp"].isoformat(),
             "delivered": False,
         },
     }
 
     if "file" in message_doc:
-        payload["data"]["file"] = {
-            "filename": message_doc["file"]["filename"],
-            "size": message_doc["file"]["size"],
-            "content_type": message_doc["file"]["content_type"],
-        }
-
-    await websocket.send_json(payload)
-    await manager.send_to_group(message_data["receiver"], payload)
-
-    await messages_collection.update_one(
-        {"_id": ObjectId(message_id)},
-        {"$set": {"delivered": True}}
-    )
-
-    await rooms_collection.update_one(
-        {"_id": ObjectId(room_id)},
-        {"$set": {"last_message_at": datetime.utcnow()}}
+        payload["data"]["file"] = file_metadata(message_doc["file"])
+
+    await send_json(websocket, payload)
+    # The room bump doesn't depend on the fan-out, so overlap the two
+    await asyncio.gather(
+        manager.send_to_group(message_data.receiver, payload),
+        rooms_collection.update_one(
+            {"_id": ObjectId(room_id)},
+            {"$set": {"last_message_at": message_doc["timestamp"]}}
+        ),
     )
 
-async def receive_message_read(websocket: WebSocket, email: str, data: dict):
-    message_id = data.get("data", {}).get("message_id")
-    if not message_id:
-        await send_error(websocket, "validation_error", "Missing message_id")
-        return
+async def receive_message_read(websocket: WebSocket, email: str, data: MessageIdRequest):
+    message_id = data.message_id
+    now = datetime.utcnow()
 
-    messages_collection = await get_messages_collection()
     result = await messages_collection.update_one(
         {"_id": ObjectId(message_id), "receiver": email},
-        {"$set": {"is_read": True, "read_at": datetime.utcnow()}}
+        {"$set": {"is_read": True, "read_at": now}}
     )
 
     if result.modified_count == 0:
@@ -326,57 +480,49 @@ async def receive_message_read(websocket: WebSocket, email: str, data: dict):
         "data": {
             "message_id": message_id,
             "status": "read",
-            "read_at": datetime.utcnow().isoformat(),
+            "read_at": now.isoformat(),
         },
     })
 
-async def receive_message_edit(websocket: WebSocket, email: str, data: dict):
-    message_data = data.get("data", {})
-    required_fields = ["message_id", "new_message"]
-    if not all(field in message_data for field in required_fields):
-        await send_error(websocket, "validation_error", "Missing required fields")
-        return
-
-    messages_collection = await get_messages_collection()
-    result = await messages_collection.update_one(
-        {"_id": ObjectId(message_data["message_id"]), "sender": email},
+async def receive_message_edit(websocket: WebSocket, email: str, message_data: MessageEditRequest):
+    now = datetime.utcnow()
+    # Update and read back in one round-trip, fetching only what the event needs
+    updated_message = await messages_collection.find_one_and_update(
+        {"_id": ObjectId(message_data.message_id), "sender": email},
         {
             "$set": {
-                "message": message_data["new_message"],
+                "message": message_data.new_message,
                 "edited": True,
-                "edited_at": datetime.utcnow(),
+                "edited_at": now,
             }
-        }
+        },
+        projection={"room_id": 1, "sender": 1, "receiver": 1, "edited_at": 1},
+        return_document=ReturnDocument.AFTER,
     )
 
-    if result.modified_count == 0:
+    if updated_message is None:
         await send_error(websocket, "not_found", "Message not found or not authorized to edit")
         return
 
-    updated_message = await messages_collection.find_one({"_id": ObjectId(message_data["message_id"])})
     payload = {
         "source": "message.edit",
         "data": {
-            "message_id": message_data["message_id"],
+            "message_id": message_data.message_id,
             "room_id": updated_message["room_id"],
             "sender": updated_message["sender"],
             "receiver": updated_message["receiver"],
-            "new_message": message_data["new_message"],
-            "edited_at": updated_message.get("edited_at", datetime.utcnow()).isoformat(),
+            "new_message": message_data.new_message,
+            "edited_at": updated_message.get("edited_at", now).isoformat(),
         },
     }
 
     await manager.send_to_group(updated_message["sender"], payload)
     await manager.send_to_group(updated_message["receiver"], payload)
 
-async def receive_message_delete(websocket: WebSocket, email: str, data: dict):
-    message_id = data.get("data", {}).get("message_id")
-    if not message_id:
-        await send_error(websocket, "validation_error", "Missing message_id")
-        return
+async def receive_message_delete(websocket: WebSocket, email: str, data: MessageIdRequest):
+    message_id = data.message_id
 
-    messages_collection = await get_messages_collection()
-    message = await messages_collection.find_one({"_id": ObjectId(message_id)})
+    message = await messages_collection.find_one({"_id": ObjectId(message_id)}, MESSAGE_PROJECTION)
     if not message:
         await send_error(websocket, "not_found", "Message not found")
         return
@@ -390,6 +536,13 @@ async def receive_message_delete(websocket: WebSocket, email: str, data: dict):
         await send_error(websocket, "server_error", "Failed to delete message")
         return
 
+    if message.get("file", {}).get("file_id"):
+        # The message is already gone; a missing blob must not block the broadcast
+        try:
+            await files_bucket.delete(message["file"]["file_id"])
+        except NoFile:
+            logger.warning(f"Attachment {message['file']['file_id']} for message {message_id} already removed")
+
     payload = {
         "source": "message.delete",
         "data": {
@@ -403,32 +556,24 @@ async def receive_message_delete(websocket: WebSocket, email: str, data: dict):
     await manager.send_to_group(message["sender"], payload)
     await manager.send_to_group(message["receiver"], payload)
 
-async def receive_message_type(websocket: WebSocket, email: str, data: dict):
-    required_fields = ["room_id", "receiver"]
-    if not all(field in data.get("data", {}) for field in required_fields):
-        await send_error(websocket, "validation_error", "Missing required fields")
-        return
-
-    await manager.send_to_group(data["data"]["receiver"], {
+async def receive_message_type(websocket: WebSocket, email: str, data: MessageTypeRequest):
+    await manager.send_to_group(data.receiver, {
         "source": "message.type",
         "data": {
-            "room_id": data["data"]["room_id"],
+            "room_id": data.room_id,
             "sender": email,
-            "is_typing": data["data"].get("is_typing", True),
+            "is_typing": data.is_typing,
         },
     })
 
-async def receive_user_status(websocket: WebSocket, email: str, data: dict):
-    target_email = data.get("data", {}).get("email")
-    if not target_email:
-        await send_error(websocket, "validation_error", "Missing email")
-        return
+async def receive_user_status(websocket: WebSocket, email: str, data: UserStatusRequest):
+    target_email = data.email
 
     redis_client = await get_redis_client()
     status = await redis_client.get(get_safe_cache_key("user_status", target_email)) or "offline"
     last_seen = await redis_client.get(get_safe_cache_key("user_last_seen", target_email))
 
-    await websocket.send_json({
+    await send_json(websocket, {
         "source": "user.status",
         "data": {
             "email": target_email,
@@ -437,44 +582,52 @@ async def receive_user_status(websocket: WebSocket, email: str, data: dict):
         },
     })
 
-async def receive_user_list(websocket: WebSocket, email: str, data: dict):
+async def receive_user_list(websocket: WebSocket, email: str, data: UserListRequest):
     try:
-        is_pagination = data.get("is_pagination", True)
-        page = int(data.get("page", 1))
-        per_page = int(data.get("per_page", 10))
-        search_query = data.get("search", "").strip()
-        
-        # Check cache
-        cache_key = f"user_list:{email}:{page}:{per_page}:{search_query}"
+        is_pagination = data.is_pagination
+        page = data.page
+        per_page = data.per_page
+        search_query = data.search.strip()
+
+        # Check cache. Search results change per keystroke and are rarely asked
+        # for twice, so only the plain listing is cached
         redis_client = await get_redis_client()
-        cached_data = await redis_client.get(cache_key)
-        if cached_data:
-            await websocket.send_json(json.loads(cached_data))
-            return
+        cache_key = None
+        if not search_query:
+            cache_key = f"user_list:{email}:{int(is_pagination)}:{page}:{per_page}"
+            cached_data = await redis_client.get(cache_key)
+            if cached_data:
+                await websocket.send_text(cached_data)
+                return
 
         # Parallelize data fetching
         async def fetch_users(session: AsyncSession):
-            query = select(User.id, User.email, User.role, User.is_active).where(User.email != email)
+            # COUNT(*) OVER () is evaluated before OFFSET/LIMIT, so every row carries
+            # the total match count and one query replaces the separate count
+            query = select(
+                User.id, User.email, User.role, User.is_active, func.count().over().label("total")
+            ).where(User.email != email)
             if search_query:
                 query = query.where(User.email.ilike(f"%{search_query}%"))
-            
-            # Count total users
-            count_query = select(func.count()).select_from(User).where(User.email != email)
-            if search_query:
-                count_query = select(func.count()).select_from(query.subquery())
-            total_result = await session.execute(count_query)
-            total_users = total_result.scalar_one()
-            
+
             # Apply pagination
             if is_pagination:
                 query = query.offset((page - 1) * per_page).limit(per_page)
-            
+
             result = await session.execute(query)
-            return total_users, result.all()
+            rows = result.all()
+            if rows:
+                return rows[0].total, rows
+            if is_pagination and page > 1:
+                # Past the last page no row carries the window count; count separately
+                count_query = select(func.count()).select_from(User).where(User.email != email)
+                if search_query:
+                    count_query = count_query.where(User.email.ilike(f"%{search_query}%"))
+                return await session.scalar(count_query), rows
+            return 0, rows
 
         async def fetch_unread_counts(emails):
-            messages_collection = await get_messages_collection()
-            unread_counts_cursor = messages_collection.aggregate([
+            unread_counts_cursor = await messages_collection.aggregate([
                 {"$match": {
                     "receiver": email,
                     "is_read": False,
@@ -484,14 +637,13 @@ async def receive_user_list(websocket: WebSocket, email: str, data: dict):
                     "_id": "$sender",
                     "unread_count": {"$sum": 1}
                 }},
-            ])
+            ], allowDiskUse=False)
             return {doc["_id"]: doc["unread_count"] async for doc in unread_counts_cursor}
 
         async def fetch_rooms():
-            rooms_collection = await get_rooms_collection()
+            # Plain $size instead of $expr so the participants index can be used
             rooms_cursor = rooms_collection.find({
-                "participants": email,
-                "$expr": {"$eq": [{"$size": "$participants"}, 2]}
+                "$and": [{"participants": email}, {"participants": {"$size": 2}}]
             }, {"participants": 1, "_id": 1})
             return {str(room["_id"]): room async for room in rooms_cursor}
 
@@ -506,14 +658,17 @@ async def receive_user_list(websocket: WebSocket, email: str, data: dict):
             total_users, users_query = await fetch_users(session)
             break  # Only need one session
         emails = [user.email for user in users_query]
+        email_set = set(emails)
+        # Quote each email once; same key format as get_safe_cache_key
+        safe_emails = [quote(u) for u in emails]
 
         # Execute other queries concurrently
         unread_dict, rooms, redis_results = await asyncio.gather(
             fetch_unread_counts(emails),
             fetch_rooms(),
             fetch_redis_data(
-                [get_safe_cache_key("user_status", u) for u in emails],
-                [get_safe_cache_key("user_last_seen", u) for u in emails]
+                [f"user_status_{u}" for u in safe_emails],
+                [f"user_last_seen_{u}" for u in safe_emails]
             )
         )
 
@@ -522,15 +677,13 @@ async def receive_user_list(websocket: WebSocket, email: str, data: dict):
         for room_id, room in rooms.items():
             participants = room["participants"]
             other_user = next((p for p in participants if p != email), None)
-            if other_user in emails:
+            if other_user in email_set:
                 room_map[other_user] = room_id
 
-        # Process Redis results
+        # Process Redis results, keyed by email
         num_users = len(emails)
-        status_values = redis_results[:num_users]
-        last_seen_values = redis_results[num_users:]
-        status_dict = {get_safe_cache_key("user_status", user.email): v or "offline" for user, v in zip(users_query, status_values)}
-        last_seen_dict = {get_safe_cache_key("user_last_seen", user.email): v for user, v in zip(users_query, last_seen_values) if v}
+        status_dict = dict(zip(emails, redis_results[:num_users]))
+        last_seen_dict = dict(zip(emails, redis_results[num_users:]))
 
         # Build user list
         user_list = [
@@ -538,8 +691,8 @@ async def receive_user_list(websocket: WebSocket, email: str, data: dict):
                 id=str(user.id),
                 email=user.email,
                 role=user.role,
-                is_status=status_dict.get(get_safe_cache_key("user_status", user.email), "offline"),
-                last_seen=last_seen_dict.get(get_safe_cache_key("user_last_seen", user.email)),
+                is_status=status_dict.get(user.email) or "offline",
+                last_seen=last_seen_dict.get(user.email),
                 unread_count=unread_dict.get(user.email, 0),
                 room_id=room_map.get(user.email)
             ).dict()
@@ -556,23 +709,20 @@ async def receive_user_list(websocket: WebSocket, email: str, data: dict):
             }
 
         # Cache response
-        await redis_client.setex(cache_key, 60, json.dumps(response))
-        await websocket.send_json(response)
+        encoded = _dumps(response)
+        if cache_key:
+            await redis_client.setex(cache_key, 60, encoded)
+        await websocket.send_text(encoded)
 
     except Exception as e:
         logger.error(f"User list error: {str(e)}", exc_info=True)
         await send_error(websocket, "server_error", f"Failed to fetch users: {str(e)}")
 
-async def receive_message_list(websocket: WebSocket, email: str, data: dict):
+async def receive_message_list(websocket: WebSocket, email: str, data: MessageListRequest):
     try:
-        room_id = data.get("data", {}).get("room_id")
-        if not room_id:
-            logger.debug(f"No room_id provided for {email}, returning user list")
-            await receive_user_list(websocket, email, data)
-            return
-
-        page = int(data.get("data", {}).get("page", 0))
-        page_size = min(int(data.get("data", {}).get("page_size", 20)), 100)
+        room_id = data.room_id
+        page = data.page
+        page_size = min(data.page_size, 100)
         skip = page * page_size
 
         # Check cache for message list
@@ -580,18 +730,18 @@ async def receive_message_list(websocket: WebSocket, email: str, data: dict):
         redis_client = await get_redis_client()
         cached_data = await redis_client.get(cache_key)
         if cached_data:
-            await websocket.send_json(json.loads(cached_data))
+            await websocket.send_text(cached_data)
             return
 
-        messages_collection = await get_messages_collection()
         query = {
             "room_id": room_id,
             "$or": [{"sender": email}, {"receiver": email}],
         }
 
         total_count = await messages_collection.count_documents(query)
-        messages_cursor = messages_collection.find(query).sort("timestamp", -1).skip(skip).limit(page_size)
-        messages = []
+        messages_cursor = messages_collection.find(query, MESSAGE_PROJECTION).sort("timestamp", -1).skip(skip).limit(page_size)
+        # Cursor is newest-first (index order); appendleft yields oldest-first
+        messages = deque()
         async for msg in messages_cursor:
             msg_data = {
                 "message_id": str(msg["_id"]),
@@ -606,18 +756,13 @@ async def receive_message_list(websocket: WebSocket, email: str, data: dict):
                 "edited_at": msg.get("edited_at").isoformat() if msg.get("edited_at") else None,
             }
             if "file" in msg:
-                msg_data["file"] = {
-                    "filename": msg["file"]["filename"],
-                    "size": msg["file"]["size"],
-                    "content_type": msg["file"]["content_type"],
-                }
-            messages.append(msg_data)
-        messages.reverse()
+                msg_data["file"] = file_metadata(msg["file"])
+            messages.appendleft(msg_data)
 
         response = {
             "source": "message.list",
             "data": {
-                "messages": messages,
+                "messages": list(messages),
                 "page": page,
                 "page_size": page_size,
                 "total": total_count,
@@ -626,20 +771,16 @@ async def receive_message_list(websocket: WebSocket, email: str, data: dict):
         }
 
         # Cache with short TTL since messages can change
-        await redis_client.setex(cache_key, 30, json.dumps(response))
-        await websocket.send_json(response)
+        encoded = _dumps(response)
+        await redis_client.setex(cache_key, 30, encoded)
+        await websocket.send_text(encoded)
     except Exception as e:
         logger.error(f"Message list error: {str(e)}", exc_info=True)
         await send_error(websocket, "server_error", "Failed to fetch messages")
 
-async def receive_read_list(websocket: WebSocket, email: str, data: dict):
-    payload = data.get("data", {})
-    sender = payload.get("sender")
-    if not sender:
-        await send_error(websocket, "validation_error", "Missing sender")
-        return
+async def receive_read_list(websocket: WebSocket, email: str, data: ReadListRequest):
+    sender = data.sender
 
-    messages_collection = await get_messages_collection()
     now = datetime.utcnow()
     result = await messages_collection.update_many(
         {"sender": sender, "receiver": email, "is_read": False},
@@ -660,35 +801,49 @@ async def receive_read_list(websocket: WebSocket, email: str, data: dict):
         }
     })
 
-async def receive_ping(websocket: WebSocket, email: str, data: dict):
-    await websocket.send_json({"source": "pong"})
-
-async def send_pending_messages(websocket: WebSocket, email: str):
-    messages_collection = await get_messages_collection()
-    pending_messages_cursor = messages_collection.find({"receiver": email, "delivered": False}).sort("timestamp", 1)
+async def receive_ping(websocket: WebSocket, email: str, data: EmptyRequest):
+    await send_json(websocket, {"source": "pong"})
+
+# Message source -> (handler, payload model), built once instead of looked up in globals() per message
+HANDLERS = {
+    "message.send": (receive_message_send, MessageSendRequest),
+    "message.read": (receive_message_read, MessageIdRequest),
+    "message.edit": (receive_message_edit, MessageEditRequest),
+    "message.delete": (receive_message_delete, MessageIdRequest),
+    "message.type": (receive_message_type, MessageTypeRequest),
+    "message.list": (receive_message_list, MessageListRequest),
+    "user.status": (receive_user_status, UserStatusRequest),
+    "user.list": (receive_user_list, UserListRequest),
+    "read.list": (receive_read_list, ReadListRequest),
+    "ping": (receive_ping, EmptyRequest),
+}
+
+async def send_pending_messages(websocket: WebSocket, email: str, supports_batch: bool = False):
+    pending_messages_cursor = messages_collection.find({"receiver": email, "delivered": False}, MESSAGE_PROJECTION).sort("timestamp", 1)
     pending_messages = [msg async for msg in pending_messages_cursor]
 
-    # Send messages
+    payloads = []
     for msg in pending_messages:
-        payload = {
-            "source": "message.send",
-            "data": {
-                "message_id": str(msg["_id"]),
-                "room_id": msg["room_id"],
-                "sender": msg["sender"],
-                "receiver": msg["receiver"],
-                "message": msg["message"],
-                "timestamp": msg["timestamp"].isoformat(),
-                "delivered": True,
-            },
+        message = {
+            "message_id": str(msg["_id"]),
+            "room_id": msg["room_id"],
+            "sender": msg["sender"],
+            "receiver": msg["receiver"],
+            "message": msg["message"],
+            "timestamp": msg["timestamp"].isoformat(),
+            "delivered": True,
         }
         if "file" in msg:
-            payload["data"]["file"] = {
-                "filename": msg["file"]["filename"],
-                "size": msg["file"]["size"],
-                "content_type": msg["file"]["content_type"],
-            }
-        await websocket.send_json(payload)
+            message["file"] = file_metadata(msg["file"])
+        payloads.append(message)
+
+    # Send messages: one frame for the whole backlog when the client supports it
+    if supports_batch:
+        if payloads:
+            await websocket.send_text(_dumps({"source": "message.batch", "data": payloads}))
+    else:
+        for message in payloads:
+            await send_json(websocket, {"source": "message.send", "data": message})
 
     # Batch update delivered status
     if pending_messages:
@@ -700,8 +855,7 @@ async def send_pending_messages(websocket: WebSocket, email: str):
 
 async def receive_unread_message(websocket: WebSocket, email: str):
     try:
-        messages_collection = await get_messages_collection()
-        unread_aggregation = messages_collection.aggregate([
+        unread_aggregation = await messages_collection.aggregate([
             {"$match": {"receiver": email, "is_read": False}},
             {"$group": {"_id": "$sender", "unread_count": {"$sum": 1}}},
         ])
@@ -709,7 +863,7 @@ async def receive_unread_message(websocket: WebSocket, email: str):
             {"sender": entry["_id"], "unread_count": entry["unread_count"]}
             async for entry in unread_aggregation
         ]
-        await websocket.send_json({
+        await send_json(websocket, {
             "source": "message.unread",
             "data": unread_summary
         })
@@ -721,8 +875,8 @@ async def websocket_listener(websocket: WebSocket):
     await websocket.accept()
     try:
         while True:
-            data = await websocket.receive_json()
-            logger.debug(f"Notification received: {data}")
-            await websocket.send_json({"status": "received", "data": data})
+            data = orjson.loads(await websocket.receive_text())
+            logger.debug("Notification received: %s", data)
+            await send_json(websocket, {"status": "received", "data": data})
     except WebSocketDisconnect:
         logger.info("Notifications WebSocket disconnected")
\ No newline at end of file
@@ -1,5 +1,10 @@
-import random
+import os
+import json
+import time
+from secrets import token_urlsafe
 from datetime import datetime
+from functools import lru_cache
+from cachetools import TTLCache
 from fastapi import HTTPException
 
 base_url = "http://localhost:8000"
@@ -9,10 +14,12 @@ from src.configure.settings import settings
 
 # Store the number of clicks each short URL has received.
 
+# Verified token payloads, so reconnect storms don't re-run the HMAC check per handshake
+_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+
 
 def generate_self_short_ulr(url: str) -> str:
-    random_slug = "".join(random.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=6))
-    return f"{base_url}/short.ly/{random_slug}"
+    return f"{base_url}/short.ly/{token_urlsafe(5)[:6]}"
 
 
 def generate_timestamp() -> str:
@@ -24,14 +31,21 @@ async def generate_token(user: dict):
     return token
 
 
-async def decode_token(token: str):
+def decode_token(token: str):
+    cached = _token_cache.get(token)
+    if cached is not None:
+        # Entries live up to 30s, which can outlast the token itself
+        if "exp" not in cached or cached["exp"] > time.time():
+            return dict(cached)
+        _token_cache.pop(token, None)
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
         )
         if "exp" in payload and payload["exp"] < int(datetime.utcnow().timestamp()):
             return {"error": "Your session has expired. Please log in again."}
-        return payload
+        _token_cache[token] = payload
+        return dict(payload)
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=401, detail="Your session has expired. Please log in again."
@@ -41,7 +55,17 @@ async def decode_token(token: str):
 
 
 async def generate_unique_id(prefix: str, length: int = 20) -> str:
-    random_id = "".join(
-        random.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=length)
-    )
-    return f"{prefix}_{random_id}"
+    return f"{prefix}_{token_urlsafe(length)[:length]}"
+
+
+
+@lru_cache(maxsize=1)
+def load_google_client_config() -> dict | None:
+    """Parse the Google OAuth client secrets file once per process.
+    Returns None when the file is not configured.
+    """
+    creds_path = settings.GOOGLE_CLIENT_SECRET_PATH
+    if not creds_path or not os.path.exists(creds_path):
+        return None
+    with open(creds_path) as f:
+        return json.load(f)
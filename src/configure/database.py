@@ -1,15 +1,30 @@
+import asyncio
+import logging
+from sqlalchemy import text, make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from motor.motor_asyncio import AsyncIOMotorClient
 from src.configure.settings import settings
 
+logger = logging.getLogger(__name__)
+
 # PostgreSQL Configuration
+POOL_SIZE = settings.POOL_SIZE
+POOL_WARM_SIZE = 2  # connections opened per worker at startup
+# asyncpg caches prepared statements per connection; the SQLAlchemy-side
+# prepared statement cache is a dialect option and only accepted in the URL
+POSTGRES_URL = make_url(settings.POSTGRES_SQL_URL).update_query_dict(
+    {"prepared_statement_cache_size": "512"}
+)
 engine = create_async_engine(
-    settings.POSTGRES_SQL_URL, 
-    pool_size=5, 
-    max_overflow=10, 
+    POSTGRES_URL, 
+    pool_size=POOL_SIZE, 
+    max_overflow=5, 
     pool_timeout=30, 
-    echo=False
+    pool_recycle=600,
+    pool_pre_ping=True,
+    echo=False,
+    hide_parameters=True,
+    connect_args={"statement_cache_size": 2048},
 )
 Base = declarative_base()
 AsyncSessionLocal = async_sessionmaker(
@@ -22,17 +37,47 @@ AsyncSessionLocal = async_sessionmaker(
 async def get_db():
     async with AsyncSessionLocal() as db:
         yield db
+
+async def warm_up_pool():
+    """Open a few connections up front so the first requests don't pay the connect cost."""
+    async def _ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    # Every gunicorn worker runs this, so stay far below max_connections; the
+    # rest of the pool fills on demand. A failure only costs the head start.
+    results = await asyncio.gather(*(_ping() for _ in range(min(POOL_SIZE, POOL_WARM_SIZE))), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        logger.warning(f"Postgres pool warm-up failed for {len(errors)} connection(s): {errors[0]}")
     
 
 # MongoDB Configuration
 MONGO_URI = settings.MONGODB_URL
 MONGO_DB_NAME = settings.MONGODB_DB_NAME
+MONGO_MAX_POOL_SIZE = 50
+MONGO_MIN_POOL_SIZE = 5
 mongo_client = None
+_mongo_lock = asyncio.Lock()
 
 async def init_mongo():
     global mongo_client
-    if mongo_client is None:
-        mongo_client = AsyncIOMotorClient(MONGO_URI)
+    async with _mongo_lock:
+        if mongo_client is None:
+            # Imported here so Celery workers and migrations, which only use
+            # Postgres, never load pymongo/bson
+            from pymongo import AsyncMongoClient
+
+            client = AsyncMongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
+            # Connect eagerly so the first request doesn't pay the handshake
+            await client.aconnect()
+            mongo_client = client
+
+async def close_mongo():
+    global mongo_client
+    if mongo_client is not None:
+        await mongo_client.close()
+        mongo_client = None
 
 async def get_mongo_db():
     if mongo_client is None:
@@ -1,11 +1,160 @@
+import atexit
+import functools
+import gzip
 import logging
 import logging.handlers
 import os
+import queue
+import shutil
+import sys
+import threading
+import time
 from pathlib import Path
 
-# Create logs directory if it doesn't exist
-LOG_DIR = Path("/app/logs") if os.path.exists("/app") else Path("logs")
-LOG_DIR.mkdir(exist_ok=True)
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no locking needed
+    fcntl = None
+
+import orjson
+
+from src.configure.settings import settings
+
+@functools.cache
+def _log_dir() -> Path:
+    """Pick /app/logs inside the container, ./logs elsewhere, and make sure it exists."""
+    log_dir = Path("/app/logs") if Path("/app").is_dir() else Path("logs")
+    log_dir.mkdir(parents=True, exist_ok=True)
+    return log_dir
+
+
+LOG_DIR = _log_dir()
+
+LOG_BUFFER_SIZE = 64 * 1024  # bytes buffered per log file before a write
+LOG_FLUSH_INTERVAL = 30  # seconds; ERROR and above are flushed immediately
+
+
+class BufferedRotatingFileHandler(logging.Handler):
+    """Size-rotated log file written in whole records, safe to share between processes.
+
+    Formatted records are buffered in memory and written with a single
+    os.write() on an O_APPEND descriptor, so a flush never ends mid-line and
+    lines from processes sharing the file don't interleave. The buffer is
+    written every LOG_BUFFER_SIZE bytes, every LOG_FLUSH_INTERVAL seconds and
+    on every ERROR. Rotated backups are gzipped.
+
+    Gunicorn and Celery prefork run several processes against one file, so
+    writes and rotation happen under an flock on <file>.lock, and a process
+    whose descriptor no longer matches the file on disk (another process
+    rotated it) reopens before writing.
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding="utf-8"):
+        super().__init__()
+        self.baseFilename = os.path.abspath(filename)
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.encoding = encoding
+        self._buffer: list[bytes] = []
+        self._buffered = 0
+        self._fd = None
+        self._fd_id = None  # (st_dev, st_ino) of the file self._fd points at
+        self._last_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + "\n").encode(self.encoding, "backslashreplace")
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+            return
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if (
+            record.levelno >= logging.ERROR
+            or self._buffered >= LOG_BUFFER_SIZE
+            or time.monotonic() - self._last_flush >= LOG_FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return
+            data = b"".join(self._buffer)
+            self._buffer.clear()
+            self._buffered = 0
+            try:
+                self._write(data)
+            except Exception as e:
+                sys.stderr.write(f"Failed to write {self.baseFilename}: {e}\n")
+
+    def _write(self, data: bytes):
+        # Opened per write rather than kept: flock is per open file description,
+        # which a forked child would otherwise share with its parent
+        with open(self.baseFilename + ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            os.write(self._current_fd(), data)
+            if self.maxBytes > 0 and self.backupCount > 0 and os.fstat(self._fd).st_size >= self.maxBytes:
+                self._rollover()
+
+    def _current_fd(self) -> int:
+        try:
+            st = os.stat(self.baseFilename)
+            on_disk = (st.st_dev, st.st_ino)
+        except FileNotFoundError:
+            on_disk = None
+        if self._fd is None or on_disk != self._fd_id:
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open(self.baseFilename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            st = os.fstat(self._fd)
+            self._fd_id = (st.st_dev, st.st_ino)
+        return self._fd
+
+    def _rollover(self):
+        # Runs under the file lock; other processes reopen on their next write
+        os.close(self._fd)
+        self._fd = None
+        self._fd_id = None
+        for i in range(self.backupCount - 1, 0, -1):
+            source = f"{self.baseFilename}.{i}.gz"
+            if os.path.exists(source):
+                os.replace(source, f"{self.baseFilename}.{i + 1}.gz")
+        rotated = f"{self.baseFilename}.1"
+        os.replace(self.baseFilename, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+        super().close()
+
+
+class JsonFormatter(logging.Formatter):
+    """One orjson-encoded object per line, so file logs need no regex parsing downstream."""
+
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "lvl": record.levelname,
+            "name": record.name,
+            "msg": record.getMessage(),
+            "func": record.funcName,
+            "line": record.lineno,
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry).decode()
+
 
 # Logging configuration
 LOGGING_CONFIG = {
@@ -20,6 +169,9 @@ LOGGING_CONFIG = {
             "format": "%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(funcName)s() - %(message)s",
             "datefmt": "%Y-%m-%d %H:%M:%S",
         },
+        "json": {
+            "()": JsonFormatter,
+        },
     },
     "handlers": {
         "console": {
@@ -29,29 +181,29 @@ LOGGING_CONFIG = {
             "stream": "ext://sys.stdout",
         },
         "file": {
-            "class": "logging.handlers.RotatingFileHandler",
+            "()": BufferedRotatingFileHandler,
             "level": "INFO",
-            "formatter": "detailed",
+            "formatter": "json",
             "filename": str(LOG_DIR / "app.log"),
-            "maxBytes": 10485760,  # 10MB
+            "maxBytes": 104857600,  # 100MB
             "backupCount": 5,
             "encoding": "utf8",
         },
         "error_file": {
-            "class": "logging.handlers.RotatingFileHandler",
+            "()": BufferedRotatingFileHandler,
             "level": "ERROR",
-            "formatter": "detailed",
+            "formatter": "json",
             "filename": str(LOG_DIR / "error.log"),
-            "maxBytes": 10485760,  # 10MB
+            "maxBytes": 104857600,  # 100MB
             "backupCount": 5,
             "encoding": "utf8",
         },
         "celery_file": {
-            "class": "logging.handlers.RotatingFileHandler",
+            "()": BufferedRotatingFileHandler,
             "level": "INFO",
-            "formatter": "detailed",
+            "formatter": "json",
             "filename": str(LOG_DIR / "celery.log"),
-            "maxBytes": 10485760,  # 10MB
+            "maxBytes": 104857600,  # 100MB
             "backupCount": 5,
             "encoding": "utf8",
         },
@@ -96,14 +248,72 @@ LOGGING_CONFIG = {
 }
 
 
-def setup_logging():
-    """Configure logging for the application"""
+# (QueueHandler, file handler) pairs, created once; listener threads are per process
+_queued_handlers: list[tuple[logging.handlers.QueueHandler, BufferedRotatingFileHandler]] = []
+_listener_pid = None
+
+
+def _queue_file_handlers():
+    """Swap every file handler attached by dictConfig for a QueueHandler."""
+    queued = {}
+    for name in LOGGING_CONFIG["loggers"]:
+        target_logger = logging.getLogger(name)
+        for handler in list(target_logger.handlers):
+            if not isinstance(handler, BufferedRotatingFileHandler):
+                continue
+            if handler not in queued:
+                queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+                queue_handler.setLevel(handler.level)
+                queued[handler] = queue_handler
+                _queued_handlers.append((queue_handler, handler))
+            target_logger.removeHandler(handler)
+            target_logger.addHandler(queued[handler])
+
+
+def configure_logging():
+    """Apply LOGGING_CONFIG. Starts no threads, so it is safe before a fork."""
     import logging.config
     logging.config.dictConfig(LOGGING_CONFIG)
-    logger = logging.getLogger(__name__)
+    if settings.ENVIRONMENT == "production":
+        # Only SQL errors, and only to the log file, never the request path's stdout
+        sql_logger = logging.getLogger("sqlalchemy.engine")
+        sql_logger.setLevel(logging.ERROR)
+        for handler in list(sql_logger.handlers):
+            if not isinstance(handler, BufferedRotatingFileHandler):
+                sql_logger.removeHandler(handler)
+    return logging.getLogger(__name__)
+
+
+def setup_logging():
+    """Move file writes off the calling thread for the current process.
+
+    Call once per process after any fork (FastAPI lifespan, Celery
+    worker_process_init): each file handler is put behind a QueueHandler and
+    drained by a QueueListener thread started here. Threads don't survive a
+    fork, so a child that inherited queued handlers starts its own listeners.
+    """
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    _listener_pid = os.getpid()
+
+    if not _queued_handlers:
+        _queue_file_handlers()
+    for queue_handler, handler in _queued_handlers:
+        listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+
+    # Push out buffered lines on quiet periods too, not only when the next record arrives
+    def _flush_periodically():
+        while True:
+            time.sleep(LOG_FLUSH_INTERVAL)
+            for _, handler in _queued_handlers:
+                handler.flush()
+
+    threading.Thread(target=_flush_periodically, name="log-flusher", daemon=True).start()
     logger.info("Logging configured successfully")
-    return logger
 
 
 # Create a default logger instance
-logger = setup_logging()
+logger = configure_logging()
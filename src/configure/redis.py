@@ -1,33 +1,38 @@
+import asyncio
 import redis.asyncio as redis
 from src.configure.settings import settings
-from urllib.parse import urlparse
 
 REDIS_CHANNEL = "user_updates"
+REDIS_MAX_CONNECTIONS = 100
+REDIS_HEALTH_CHECK_INTERVAL = 30  # seconds idle before a connection is re-checked
 redis_client = None
+_redis_lock = asyncio.Lock()
 
 
 async def init_redis():
     global redis_client
-    if redis_client is None:
-        # Parse Redis URL to extract host, port, and password
-        redis_url = settings.REDIS_URL
-        parsed = urlparse(redis_url)
-
-        # Extract host and port
-        host = parsed.hostname or "localhost"
-        port = parsed.port or 6379
-        password = parsed.password
-
-        # Initialize Redis client
-        redis_client = redis.Redis(
-            host=host,
-            port=port,
-            password=password,
-            decode_responses=True
-        )
+    async with _redis_lock:
+        if redis_client is None:
+            # Pooled client shared by every request handler; from_url keeps the
+            # username, password, db index and TLS scheme from REDIS_URL
+            pool = redis.ConnectionPool.from_url(
+                settings.REDIS_URL,
+                decode_responses=True,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            )
+            redis_client = redis.Redis(connection_pool=pool)
 
 
 async def get_redis_client() -> redis.Redis:
     if redis_client is None:
         await init_redis()
     return redis_client
+
+
+async def close_redis():
+    global redis_client
+    if redis_client is not None:
+        await redis_client.aclose()
+        await redis_client.connection_pool.disconnect()
+        redis_client = None
@@ -1,12 +1,18 @@
-from datetime import datetime
-from sqlalchemy import Column, Integer, DateTime
-from src.configure.database import Base, engine
+from sqlalchemy import Column, Integer, DateTime, func
+from src.configure.database import Base
+
+
+def utc_now():
+    """Naive UTC timestamp evaluated by PostgreSQL, matching datetime.utcnow()."""
+    return func.timezone('utc', func.now())
 
 
 class BaseModel(Base):
     __abstract__ = True
+    # Fetch server-generated columns via RETURNING so they're loaded after flush
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
-    created_at = Column(DateTime, default=datetime.utcnow())
-    updated_at = Column(DateTime, nullable=True, onupdate=datetime.utcnow())
+    created_at = Column(DateTime, server_default=utc_now())
+    updated_at = Column(DateTime, nullable=True, onupdate=utc_now())
     deleted_at = Column(DateTime, nullable=True)
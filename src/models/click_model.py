@@ -5,8 +5,9 @@ from .base import BaseModel
 
 class Clicks(BaseModel):
     __tablename__ = "clicks"
-    sort_url_id = Column(Integer, ForeignKey("ulrs.id"), nullable=False)
+    sort_url_id = Column(Integer, ForeignKey("ulrs.id"), nullable=False, unique=True)
     click_count = Column(Integer, default=0)
     last_clicked_at = Column(DateTime, nullable=True)
+    last_flush_token = Column(String, nullable=True)  # token of the last Redis click claim applied
 
 
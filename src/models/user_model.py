@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Index, text
 from .base import BaseModel
 
 class User(BaseModel):
@@ -11,9 +11,14 @@ class User(BaseModel):
     organization__org_name = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
     token_json = Column(Text, nullable=True)  # NEW: Stores Gmail OAuth token as JSON
+    outlook_token_json = Column(Text, nullable=True)  # Stores Outlook OAuth token as JSON
 
 class Email(BaseModel):
     __tablename__ = 'emails'
+    __table_args__ = (
+        # Serves the per-user "latest emails" listing without a sort
+        Index('ix_emails_user_created', 'user_id', text('created_at DESC')),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     message_id = Column(String, unique=True, nullable=False)